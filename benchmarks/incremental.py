@@ -0,0 +1,93 @@
+"""
+Time measure-level incremental reconversion: convert the parts of a synthetic score, edit a few measures, and
+convert them again from the checkpoints of the first conversion, compared with a full conversion. That both give the
+same result is checked by tests/test_incremental.py.
+
+Run from the repository root: python -m benchmarks.incremental
+"""
+
+import argparse
+import copy
+import random
+import time
+import warnings
+
+import xmlbackend
+from benchmarks import synthetic
+from instrument import Instrument
+
+
+def edit_measures(part, rng, n_edits):
+    """Apply n_edits random edits to the measures of a part: change a pitch, turn a measure into a rest, add a
+    dynamic, or delete a measure"""
+    for _ in range(n_edits):
+        measures = list(part)
+        measure = rng.choice(measures[1:])
+        edit = rng.choice(["pitch", "rest", "dynamic", "delete"])
+        steps = [step for step in measure.iter("step")]
+        if edit == "pitch" and steps:
+            rng.choice(steps).text = rng.choice("CDEFGAB")
+        elif edit == "rest" and not measure.findall("backup"):
+            for child in list(measure):
+                if child.tag in ("note", "direction", "forward"):
+                    measure.remove(child)
+            measure.append(
+                xmlbackend.fromstring(
+                    '<note><rest measure="yes"/><duration>24</duration><voice>1</voice></note>'
+                )
+            )
+        elif edit == "dynamic":
+            measure.insert(
+                0,
+                xmlbackend.fromstring(
+                    "<direction><direction-type><dynamics><ff/></dynamics></direction-type></direction>"
+                ),
+            )
+        elif edit == "delete":
+            part.remove(measure)
+
+
+def run(parts, measures, n_edits, seed=0):
+    rng = random.Random(seed)
+    root = xmlbackend.fromstring(
+        synthetic.generate(parts=parts, measures=measures, seed=seed)
+    )
+    part_list = root.find("part-list")
+    totals = {"full": 0.0, "incremental": 0.0, "measures": 0, "reused": 0}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for part in root.findall("part"):
+            previous = Instrument(part, part_list, False, checkpoints={})
+            edited = copy.deepcopy(part)
+            edit_measures(edited, rng, n_edits)
+
+            start = time.perf_counter()
+            full = Instrument(edited, part_list, False)
+            totals["full"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            incremental = Instrument(
+                edited, part_list, False, checkpoints=previous.checkpoints
+            )
+            totals["incremental"] += time.perf_counter() - start
+
+            totals["measures"] += incremental.n_measures
+            totals["reused"] += incremental.n_measures_reused
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time incremental reconversion")
+    parser.add_argument("--parts", type=int, default=10)
+    parser.add_argument("--measures", type=int, default=500)
+    parser.add_argument(
+        "--edits", type=int, default=5, help="Number of edited measures per part"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    totals = run(args.parts, args.measures, args.edits, args.seed)
+    print(f"{totals['reused']} of {totals['measures']} measures reused")
+    print(
+        f"Full conversion: {totals['full']:.3f} s, incremental: {totals['incremental']:.3f} s"
+    )
@@ -0,0 +1,55 @@
+"""
+Time the measure loop of Instrument on a synthetic score.
+
+Run from the repository root: python -m benchmarks.measure_loop
+"""
+
+import argparse
+import time
+import warnings
+
+import xmlbackend
+from benchmarks import synthetic
+from instrument import Instrument
+
+
+def time_measure_loop(parts, measures, repeat, seed=0, jobs=1):
+    root = xmlbackend.fromstring(
+        synthetic.generate(parts=parts, measures=measures, seed=seed)
+    )
+    part_list = root.find("part-list")
+    part_elements = root.findall("part")
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for part_element in part_elements:
+                Instrument(part_element, part_list, False, jobs=jobs)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the Instrument measure loop")
+    parser.add_argument("--parts", type=int, default=10)
+    parser.add_argument("--measures", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Processes parsing chunks of measures of each part",
+    )
+    args = parser.parse_args()
+
+    best = time_measure_loop(
+        args.parts, args.measures, args.repeat, args.seed, args.jobs
+    )
+    n_measures = args.parts * args.measures
+    print(
+        f"{n_measures} measures in {best:.3f} s ({n_measures / best:.0f} measures/s, best of {args.repeat})"
+    )
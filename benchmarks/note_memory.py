@@ -0,0 +1,51 @@
+"""
+Measure how many bytes each Note holds on a large synthetic score.
+
+Run from the repository root: python -m benchmarks.note_memory
+"""
+
+import argparse
+import tracemalloc
+from fractions import Fraction
+
+import xmlbackend
+from benchmarks import synthetic
+from note import Note
+
+
+def measure_note_memory(parts, measures, seed=0):
+    root = xmlbackend.fromstring(
+        synthetic.generate(parts=parts, measures=measures, seed=seed)
+    )
+    note_elements = [
+        (note_element, measure.get("number"))
+        for part in root.iter("part")
+        for measure in part
+        for note_element in measure.iter("note")
+    ]
+    time_info = (
+        24,
+        Fraction(1),
+    )  # the generator writes 6 divisions per quarter, in 4/4
+
+    tracemalloc.start()
+    notes = [
+        Note(note_element, time_info, measure_num)
+        for note_element, measure_num in note_elements
+    ]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(notes), size, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the memory used per Note")
+    parser.add_argument("--parts", type=int, default=20)
+    parser.add_argument("--measures", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    n_notes, size, peak = measure_note_memory(args.parts, args.measures, args.seed)
+    print(
+        f"{n_notes} notes: {size} bytes held ({size / n_notes:.1f} bytes/note), {peak} bytes peak"
+    )
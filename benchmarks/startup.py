@@ -0,0 +1,84 @@
+"""
+Measure the startup cost of the command line converter: the modules imported by `import mxml2ly` with their
+cumulative import times (from python -X importtime), and the wall time of whole non-interactive invocations on a
+small synthetic score.
+
+Run from the repository root: python -m benchmarks.startup
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import synthetic
+
+# modules that the non-interactive path must not import
+LAZY_MODULES = ("tkinter", "concurrent.futures.process", "pickle")
+
+
+def import_times():
+    """Map each module imported by mxml2ly to its (self, cumulative) import time in microseconds"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import mxml2ly"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def time_invocations(runs, measures, seed=0):
+    """The best wall time of runs conversions of a one-part score through `python mxml2ly.py -i ... -o ...`"""
+    with tempfile.TemporaryDirectory() as tmp:
+        input_file = os.path.join(tmp, "score.musicxml")
+        with open(input_file, "w") as score_file:
+            score_file.write(synthetic.generate(parts=1, measures=measures, seed=seed))
+        command = [
+            sys.executable,
+            "mxml2ly.py",
+            "-i",
+            input_file,
+            "-o",
+            os.path.join(tmp, "score.ly"),
+        ]
+        best = float("inf")
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of the command line converter"
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--measures", type=int, default=10)
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of slowest imports to list"
+    )
+    args = parser.parse_args()
+
+    times = import_times()
+    print(f"import mxml2ly: {times['mxml2ly'][1] / 1000:.1f} ms, {len(times)} modules")
+    for name, (_, cumulative_us) in sorted(times.items(), key=lambda item: -item[1][1])[
+        1 : args.top + 1
+    ]:
+        print(f"  {cumulative_us / 1000:7.1f} ms  {name}")
+    for name in LAZY_MODULES:
+        if name in times:
+            print(f"{name} is imported at startup")
+    best = time_invocations(args.runs, args.measures)
+    print(
+        f"mxml2ly.py -i -o on {args.measures} measures: {best * 1000:.0f} ms (best of {args.runs})"
+    )
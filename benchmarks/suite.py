@@ -0,0 +1,192 @@
+"""
+Run the converter on a set of synthetic scores, each stressing one construct, and record the time of every stage,
+the end-to-end time and the peak memory. The results are written as JSON, and can be compared with the results of
+another commit.
+
+Run from the repository root: python -m benchmarks.suite -o results.json [--compare baseline.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import mxml2ly
+import xmlbackend
+from benchmarks import synthetic
+from instrument import Instrument
+from writer import LilyPondWriter
+
+# name: arguments of synthetic.generate
+SCENARIOS = {
+    "default": dict(parts=10, measures=300),
+    "chords": dict(parts=10, measures=300, chords=0.8),
+    "tuplets": dict(parts=10, measures=300, tuplets=0.6),
+    "polyphony": dict(parts=10, measures=300, polyphony=0.6),
+    "cues": dict(parts=10, measures=300, cues=0.5),
+    "rests": dict(parts=10, measures=300, rests=0.8),
+    "many_parts": dict(parts=60, measures=50),
+    "long_part": dict(parts=1, measures=3000),
+}
+
+# stages whose seconds are compared, lower is better
+TIMES = ("xml_parse", "convert", "write", "end_to_end")
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def time_stages(path, repeat):
+    """The sizes of the score at path and of its conversion, and the best time of each stage of converting it"""
+    root = xmlbackend.parse(path).getroot()
+    part_list = root.find("part-list")
+    part_elements = root.findall("part")
+
+    def xml_parse():
+        _, parts = mxml2ly.iterparse_score(path)
+        for _ in parts:
+            pass
+
+    def convert():
+        return [
+            Instrument(part_element, part_list, False) for part_element in part_elements
+        ]
+
+    instruments = convert()
+
+    def write():
+        writer = LilyPondWriter(io.StringIO(), "together")
+        writer.write_header(
+            "Title", mxml2ly.default_subtitle, "Composer", "Arranger", "2.24.3"
+        )
+        for instrument in instruments:
+            writer.write_instrument(instrument)
+        writer.write_footer()
+
+    return {
+        "parts": len(part_elements),
+        "measures": sum(instrument.n_measures for instrument in instruments),
+        "notes": sum(1 for _ in root.iter("note")),
+        "input_bytes": os.path.getsize(path),
+        "output_bytes": len(mxml2ly.convert(path).encode()),
+        "xml_parse": best_time(xml_parse, repeat),
+        "convert": best_time(convert, repeat),
+        "write": best_time(write, repeat),
+        "end_to_end": best_time(lambda: mxml2ly.convert(path), repeat),
+    }
+
+
+def run_scenario(path, repeat):
+    """Time each stage of converting the score at path, and measure the peak memory of a whole conversion"""
+    # the parsed score and the instruments of time_stages are freed before the memory is measured
+    result = time_stages(path, repeat)
+    tracemalloc.start()
+    mxml2ly.convert(path)
+    result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result["measures_per_s"] = result["measures"] / result["end_to_end"]
+    result["notes_per_s"] = result["notes"] / result["end_to_end"]
+    return result
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names, scale, repeat, seed=0):
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "xml_backend": xmlbackend.name,
+        "scale": scale,
+        "repeat": repeat,
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp, warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for name in names:
+            options = dict(SCENARIOS[name])
+            options["measures"] = max(1, round(options["measures"] * scale))
+            path = os.path.join(tmp, name + ".musicxml")
+            with open(path, "w") as score_file:
+                score_file.write(synthetic.generate(seed=seed, **options))
+            results["scenarios"][name] = run_scenario(path, repeat)
+    return results
+
+
+def print_results(results, baseline=None):
+    header = (
+        f"{'scenario':<12}"
+        + "".join(f"{stage:>12}" for stage in TIMES)
+        + f"{'measures/s':>12}{'peak MB':>10}"
+    )
+    print(header)
+    for name, result in results["scenarios"].items():
+        line = f"{name:<12}" + "".join(
+            f"{result[stage] * 1000:10.1f}ms" for stage in TIMES
+        )
+        line += f"{result['measures_per_s']:12.0f}{result['peak_memory'] / 2**20:10.1f}"
+        print(line)
+        if baseline is not None and name in baseline["scenarios"]:
+            old = baseline["scenarios"][name]
+            ratios = "".join(f"{result[stage] / old[stage]:11.2f}x" for stage in TIMES)
+            print(
+                f"{'  vs ' + str(baseline.get('commit')):<12}{ratios}{'':12}"
+                f"{result['peak_memory'] / old['peak_memory']:9.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the converter on synthetic scores"
+    )
+    parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    parser.add_argument(
+        "--compare",
+        help="JSON results of an earlier run, to print the ratios of the times to",
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Factor applied to the number of measures",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_suite(args.scenarios, args.scale, args.repeat, args.seed)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
@@ -0,0 +1,177 @@
+"""
+Generator for synthetic partwise MusicXML scores, used by the benchmarks.
+
+The scores only use constructs that mxml2ly understands: chords, dotted notes, triplets, full-measure rests (in runs),
+two-voice measures joined by a backup, cue passages, dynamics, key changes and barlines.
+"""
+
+import random
+
+STEPS = ["C", "D", "E", "F", "G", "A", "B"]
+NAMES = [
+    "Flute",
+    "Oboe",
+    "Clarinet",
+    "Bassoon",
+    "Horn",
+    "Trumpet",
+    "Trombone",
+    "Viola",
+    "Cello",
+    "Violin",
+]
+TYPES = {
+    24: ("whole", False),
+    12: ("half", False),
+    18: ("half", True),
+    6: ("quarter", False),
+    9: ("quarter", True),
+    3: ("eighth", False),
+    1.5: ("16th", False),
+}
+
+
+def pitch_xml(rng):
+    alter = rng.choice(["", "", "", "<alter>1</alter>", "<alter>-1</alter>"])
+    return f"<pitch><step>{rng.choice(STEPS)}</step>{alter}<octave>{rng.randint(2, 6)}</octave></pitch>"
+
+
+def note_xml(
+    rng, dur, voice=1, cue=False, chord=False, rest=False, extra="", tm="", notations=""
+):
+    typ, dot = TYPES[dur] if not tm else ("eighth", False)
+    body = "<chord/>" if chord else ""
+    body += "<rest/>" if rest else pitch_xml(rng)
+    body += f"<duration>{int(dur) if not tm else 2}</duration>"
+    body += "<cue/>" if cue else ""
+    body += f"<voice>{voice}</voice><type>{typ}</type>"
+    body += "<dot/>" if dot else ""
+    body += tm + extra
+    if notations:
+        body += f"<notations>{notations}</notations>"
+    return f"<note>{body}</note>"
+
+
+def fill(rng, total, cue=False, voice=1, chords=0.0, allow_rest=True):
+    out = []
+    left = total
+    while left > 0:
+        choices = [d for d in (12, 6, 9, 3) if d <= left]
+        d = rng.choice(choices)
+        left -= d
+        rest = allow_rest and rng.random() < 0.1
+        notations = ""
+        if not rest and rng.random() < 0.2:
+            notations = (
+                "<articulations><"
+                + rng.choice(["staccato", "accent", "tenuto"])
+                + "/></articulations>"
+            )
+        out.append(
+            note_xml(rng, d, voice=voice, cue=cue, rest=rest, notations=notations)
+        )
+        if not rest and rng.random() < chords:
+            out.append(note_xml(rng, d, voice=voice, cue=cue, chord=True))
+    return out
+
+
+def measure(rng, n, kind, opts, attrs=""):
+    items = [attrs] if attrs else []
+    if kind == "rest":
+        items.append(
+            '<note><rest measure="yes"/><duration>24</duration><voice>1</voice></note>'
+        )
+    elif kind == "tuplet":
+        tm = "<time-modification><actual-notes>3</actual-notes><normal-notes>2</normal-notes></time-modification>"
+        for i in range(3):
+            nt = (
+                '<tuplet type="start"/>'
+                if i == 0
+                else ('<tuplet type="stop"/>' if i == 2 else "")
+            )
+            items.append(note_xml(rng, 2, tm=tm, notations=nt))
+        items += fill(rng, 18, chords=opts["chords"])
+    elif kind == "poly":
+        items += fill(rng, 24, chords=opts["chords"], allow_rest=False)
+        items.append("<backup><duration>24</duration></backup>")
+        items += fill(rng, 24, voice=2, allow_rest=False)
+    elif kind == "cue":
+        items += fill(rng, 24, cue=True, allow_rest=False)
+    else:
+        if rng.random() < 0.3:
+            dyn = rng.choice(["p", "mf", "f", "pp"])
+            items.append(
+                f"<direction><direction-type><dynamics><{dyn}/></dynamics></direction-type></direction>"
+            )
+        items += fill(rng, 24, chords=opts["chords"])
+    if n % 16 == 0:
+        items.append(
+            '<barline location="right"><bar-style>light-light</bar-style></barline>'
+        )
+    return f'<measure number="{n}">' + "".join(items) + "</measure>"
+
+
+def generate(
+    parts=4,
+    measures=64,
+    chords=0.2,
+    tuplets=0.1,
+    polyphony=0.1,
+    cues=0.05,
+    rests=0.2,
+    seed=0,
+):
+    """
+    Return the MusicXML text of a score with the given number of parts and measures. The other arguments are the
+    probabilities of each kind of measure (and of a note being a chord), and the random seed.
+    """
+    rng = random.Random(seed)
+    opts = {"chords": chords}
+    part_list = []
+    part_elems = []
+    for p in range(parts):
+        pid = f"P{p + 1}"
+        name = f"{NAMES[p % len(NAMES)]} {chr(ord('A') + p // len(NAMES))}"
+        part_list.append(
+            f'<score-part id="{pid}"><part-name>{name}</part-name></score-part>'
+        )
+        ms = []
+        run = 0
+        for n in range(1, measures + 1):
+            attrs = ""
+            if n == 1:
+                attrs = (
+                    "<attributes><divisions>6</divisions><key><fifths>0</fifths></key>"
+                    "<time><beats>4</beats><beat-type>4</beat-type></time>"
+                    "<clef><sign>G</sign><line>2</line></clef></attributes>"
+                )
+            elif n % 32 == 0:
+                attrs = f"<attributes><key><fifths>{rng.randint(-3, 3)}</fifths></key></attributes>"
+            if run > 0:
+                kind = "rest"
+                run -= 1
+            else:
+                r = rng.random()
+                if r < rests:
+                    kind = "rest"
+                    run = rng.randint(0, 6)
+                elif r < rests + tuplets:
+                    kind = "tuplet"
+                elif r < rests + tuplets + polyphony:
+                    kind = "poly"
+                elif r < rests + tuplets + polyphony + cues:
+                    kind = "cue"
+                else:
+                    kind = "normal"
+            ms.append(measure(rng, n, kind, opts, attrs))
+        part_elems.append(f'<part id="{pid}">' + "".join(ms) + "</part>")
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<score-partwise version="4.0">'
+        "<work><work-title>Synthetic</work-title></work>"
+        '<identification><creator type="composer">Generator</creator></identification>'
+        "<part-list>"
+        + "".join(part_list)
+        + "</part-list>"
+        + "".join(part_elems)
+        + "</score-partwise>\n"
+    )
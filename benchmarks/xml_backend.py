@@ -0,0 +1,76 @@
+"""
+Compare the throughput of reading and converting scores with each available XML backend (see xmlbackend.py), by
+running the benchmark suite once per backend.
+
+Run from the repository root: python -m benchmarks.xml_backend
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKENDS = ("etree", "lxml")
+
+
+def run_backend(backend, scenarios, scale, repeat):
+    """The suite results with the given backend, run in a new process since the backend is chosen at import"""
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "results.json")
+        command = [
+            sys.executable,
+            "-m",
+            "benchmarks.suite",
+            "-o",
+            output,
+            "--scenarios",
+            *scenarios,
+            "--scale",
+            str(scale),
+            "--repeat",
+            str(repeat),
+        ]
+        subprocess.run(
+            command,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            env=dict(os.environ, MXML2LY_XML_BACKEND=backend),
+        )
+        with open(output) as results_file:
+            return json.load(results_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the XML backends")
+    parser.add_argument(
+        "--scenarios", nargs="+", default=["default", "many_parts", "long_part"]
+    )
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    backends = [
+        backend
+        for backend in BACKENDS
+        if backend != "lxml" or importlib.util.find_spec("lxml") is not None
+    ]
+    if "lxml" not in backends:
+        print("lxml is not installed, only the standard library backend is measured")
+    print(
+        f"{'scenario':<12}{'backend':<8}{'parse MB/s':>12}{'parse ms':>10}{'convert ms':>12}{'measures/s':>12}"
+    )
+    results = {
+        backend: run_backend(backend, args.scenarios, args.scale, args.repeat)
+        for backend in backends
+    }
+    for scenario in args.scenarios:
+        for backend in backends:
+            result = results[backend]["scenarios"][scenario]
+            print(
+                f"{scenario:<12}{results[backend]['xml_backend']:<8}"
+                f"{result['input_bytes'] / result['xml_parse'] / 2**20:12.1f}{result['xml_parse'] * 1000:10.1f}"
+                f"{result['convert'] * 1000:12.1f}{result['measures_per_s']:12.0f}"
+            )
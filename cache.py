@@ -0,0 +1,111 @@
+import hashlib
+import os
+import pickle
+
+import expression
+import instrument
+import note
+import tables
+import xmlbackend
+from instrument import element_fingerprint
+
+
+def converter_version():
+    """A digest of the modules that convert a part, so that cached parts are invalidated when the converter changes"""
+    digest = hashlib.sha256()
+    for module in (expression, instrument, note, tables):
+        with open(module.__file__, "rb") as module_file:
+            digest.update(module_file.read())
+    return digest.hexdigest()
+
+
+class PartCache:
+    """
+    An on-disk cache of converted parts. Each Instrument is stored under a hash of the content of its <part> element, the
+    matching <score-part> entry of the part list, the converter version, the XML backend and the preferences. When the cache grows
+    beyond max_size bytes, the least recently used entries are removed.
+    """
+
+    suffix = ".part"
+
+    def __init__(self, directory, max_size, config_info=None):
+        self.directory = directory
+        self.max_size = max_size
+        salt = hashlib.sha256(converter_version().encode())
+        # the backends can differ in details of the elements, like their text
+        salt.update(xmlbackend.name.encode())
+        if config_info is not None:
+            for key, value in sorted(config_info["Preferences"].items()):
+                salt.update(f"{key}={value}\n".encode())
+        self.salt = salt.digest()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.entries = {}  # file name: (size, last use)
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(self.suffix) and entry.is_file():
+                    stat = entry.stat()
+                    self.entries[entry.name] = (stat.st_size, stat.st_mtime)
+        self.size = sum(size for size, _ in self.entries.values())
+        self.evict()
+
+    def key(self, part, part_list):
+        """The cache key of a <part> element, given the part list of the score"""
+        digest = hashlib.sha256(self.salt)
+        digest.update(element_fingerprint(part))
+        for score_part in part_list:
+            if score_part.get("id") == part.get("id"):
+                digest.update(element_fingerprint(score_part))
+                break
+        return digest.hexdigest()
+
+    def checkpoints_key(self, source, part_id):
+        """The cache key of the measure checkpoints of the last conversion of a part of the given source file"""
+        digest = hashlib.sha256(self.salt)
+        digest.update(f"checkpoints\x00{source}\x00{part_id}".encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        name = key + self.suffix
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as cache_file:
+                cached = pickle.load(cache_file)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        if name in self.entries:
+            self.entries[name] = (self.entries[name][0], os.path.getmtime(path))
+        self.hits += 1
+        return cached
+
+    def put(self, key, converted):
+        name = key + self.suffix
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as cache_file:
+            pickle.dump(converted, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if name in self.entries:
+            self.size -= self.entries[name][0]
+        stat = os.stat(path)
+        self.entries[name] = (stat.st_size, stat.st_mtime)
+        self.size += stat.st_size
+        self.evict()
+
+    def evict(self):
+        if self.size <= self.max_size:
+            return
+        for name, (size, _) in sorted(
+            self.entries.items(), key=lambda item: item[1][1]
+        ):
+            if self.size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass  # removed by another process sharing the cache
+            del self.entries[name]
+            self.size -= size
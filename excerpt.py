@@ -0,0 +1,223 @@
+import json
+import mmap
+import os
+import re
+from copy import deepcopy
+
+import xmlbackend
+
+index_version = 1
+index_suffix = ".index"
+
+# the start and end tags of <part> and <measure>, but not of <part-list>, <measure-style> and so on
+tag_pattern = re.compile(rb"<(/?)(part|measure)(?=[\s/>])([^>]*)>")
+number_pattern = re.compile(rb"""\b(?:number|id)\s*=\s*["']([^"']*)["']""")
+
+# the attributes that hold from the measure they are set in until they are set again
+replayed_attributes = ("divisions", "key", "time", "clef")
+
+
+class MeasureIndex:
+    """
+    Where every measure of every part starts and ends in a MusicXML file, and which attributes (divisions, key, time,
+    clef) each measure sets, so that a range of measures can be read and converted without the rest of the file. The
+    index is saved as JSON next to the file, and is rebuilt when the file changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        stat = os.stat(path)
+        self.stamp = [stat.st_size, stat.st_mtime_ns]
+        self.header_end = 0  # offset of the first <part>
+        # [part id, [[measure number, start, end], ...], [[measure idx, attribute xml], ...]]
+        self.parts = []
+
+    @classmethod
+    def load(cls, path):
+        """The saved index of the file at path, or a new one (saved if possible) if it is missing or out of date"""
+        index = cls(path)
+        try:
+            with open(path + index_suffix) as index_file:
+                saved = json.load(index_file)
+            if saved["version"] == index_version and saved["stamp"] == index.stamp:
+                index.header_end = saved["header_end"]
+                index.parts = saved["parts"]
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+        index.build()
+        try:
+            index.save()
+        except OSError:
+            pass  # the index is only an optimization, e.g. the directory can be read-only
+        return index
+
+    def build(self):
+        with open(self.path, "rb") as score_file, mmap.mmap(
+            score_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            measures = None
+            start = 0
+            for match in tag_pattern.finditer(data):
+                closing, tag, attributes = match.groups()
+                if tag == b"part":
+                    if closing:
+                        continue
+                    if not self.parts:
+                        self.header_end = match.start()
+                    measures = []
+                    self.parts.append([self.attribute_value(attributes), measures, []])
+                elif not closing:
+                    start = match.start()
+                    number = self.attribute_value(attributes)
+                else:
+                    measures.append([number, start, match.end()])
+                    if b"<attributes" in data[start : match.end()]:
+                        measure = xmlbackend.fromstring(data[start : match.end()])
+                        for attribute in measure.iterfind("attributes/*"):
+                            if attribute.tag in replayed_attributes:
+                                attribute.tail = None
+                                self.parts[-1][2].append(
+                                    [
+                                        len(measures) - 1,
+                                        xmlbackend.tostring(attribute).decode(),
+                                    ]
+                                )
+
+    @staticmethod
+    def attribute_value(attributes):
+        match = number_pattern.search(attributes)
+        return match.group(1).decode() if match is not None else ""
+
+    def save(self):
+        tmp_path = f"{self.path}{index_suffix}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as index_file:
+            json.dump(
+                {
+                    "version": index_version,
+                    "stamp": self.stamp,
+                    "header_end": self.header_end,
+                    "parts": self.parts,
+                },
+                index_file,
+            )
+        os.replace(tmp_path, self.path + index_suffix)
+
+    def starts_at(self, number):
+        """Whether the first measure of the score has the given number"""
+        return (
+            not self.parts or not self.parts[0][1] or self.parts[0][1][0][0] == number
+        )
+
+    def read_header(self):
+        """The root element of the score, holding everything before the first part"""
+        with open(self.path, "rb") as score_file:
+            header = score_file.read(self.header_end)
+        return xmlbackend.fromstring(header + b"</score-partwise>")
+
+    def read_part(self, part_idx, first, last):
+        """The part at part_idx with only the measures numbered first to last, ready to be converted on its own"""
+        part_id, measures, attribute_changes = self.parts[part_idx]
+        start_idx, end_idx = measure_range(
+            [number for number, _, _ in measures], first, last, part_id
+        )
+        read_idx = max(start_idx - 1, 0)
+        with open(self.path, "rb") as score_file:
+            score_file.seek(measures[read_idx][1])
+            data = score_file.read(measures[end_idx - 1][2] - measures[read_idx][1])
+        offset = measures[read_idx][1]
+        part = None
+        for _, start, end in measures[read_idx:end_idx]:
+            measure = xmlbackend.fromstring(data[start - offset : end - offset])
+            if part is None:
+                part = measure.makeelement("part", {"id": part_id})
+            part.append(measure)
+        if start_idx > 0:
+            attributes = attributes_in_effect(
+                xmlbackend.fromstring(attribute_xml)
+                for measure_idx, attribute_xml in attribute_changes
+                if measure_idx < start_idx
+            )
+            previous = part[0]
+            part.remove(previous)
+            part[0] = replay(part[0], attributes, previous)
+        return part
+
+
+def measure_range(numbers, first, last, part_id):
+    """The slice of the measures numbered first to last, given the numbers of all the measures of a part"""
+    try:
+        start_idx = numbers.index(first)
+        end_idx = len(numbers) - numbers[::-1].index(last)
+    except ValueError:
+        raise ImportError(f"Measures {first}-{last} not found in part {part_id}")
+    if end_idx <= start_idx:
+        raise ImportError(f"Measure {last} is before measure {first} in part {part_id}")
+    return start_idx, end_idx
+
+
+def attributes_in_effect(changes):
+    """
+    The last of each replayed attribute among changes (in score order), in the order in which they were set. A time
+    signature is converted with the divisions in effect when it is set, so if the divisions changed after it, the
+    divisions before it are replayed before it as well.
+    """
+    latest = {}
+    divisions_at_time = None
+    for attribute in changes:
+        if attribute.tag == "time":
+            divisions_at_time = latest.get("divisions")
+        latest.pop(attribute.tag, None)
+        latest[attribute.tag] = attribute
+    attributes = list(latest.values())
+    if divisions_at_time is not None and divisions_at_time is not latest["divisions"]:
+        attributes.insert(attributes.index(latest["time"]), divisions_at_time)
+    return attributes
+
+
+def replay(measure, attributes, previous):
+    """
+    A copy of measure that starts by setting the given attributes, unless the measure sets them itself before its
+    first note, and with the directions at the end of the previous measure, which apply to its first note. Each
+    attribute gets its own <attributes> element, as if each had been set in a measure of its own.
+    """
+    replayed = measure.makeelement(measure.tag, dict(measure.attrib))
+    own = set()
+    for child in measure:
+        if child.tag in ("note", "forward", "backup"):
+            break
+        if child.tag == "attributes":
+            own.update(attribute.tag for attribute in child)
+    for attribute in attributes:
+        if attribute.tag not in own:
+            attributes_element = replayed.makeelement("attributes", {})
+            attributes_element.append(deepcopy(attribute))
+            replayed.append(attributes_element)
+    trailing = []
+    for child in previous:
+        if child.tag == "direction":
+            trailing.append(child)
+        elif child.tag in ("note", "forward", "backup"):
+            trailing = []
+    replayed.extend(deepcopy(direction) for direction in trailing)
+    replayed.extend(measure)
+    return replayed
+
+
+def excerpt_part(part, first, last):
+    """The same as MeasureIndex.read_part, for a part that has already been read"""
+    measures = list(part)
+    start_idx, end_idx = measure_range(
+        [measure.get("number") for measure in measures], first, last, part.get("id")
+    )
+    excerpt = part.makeelement(part.tag, dict(part.attrib))
+    excerpt.extend(deepcopy(measure) for measure in measures[start_idx:end_idx])
+    if start_idx > 0:
+        attributes = attributes_in_effect(
+            attribute
+            for measure in measures[:start_idx]
+            for attribute in measure.iterfind("attributes/*")
+            if attribute.tag in replayed_attributes
+        )
+        excerpt[0] = replay(excerpt[0], attributes, measures[start_idx - 1])
+    return excerpt
@@ -1,17 +1,32 @@
 class Expression:
-    dynamics = {'\\pp', '\\p', '\\mp', '\\mf', '\\f', '\\ff', '\\fp', '\\sf', '\\sfz', '\\<', '\\>', '\\cresc'}
+    dynamics = {
+        "\\pp",
+        "\\p",
+        "\\mp",
+        "\\mf",
+        "\\f",
+        "\\ff",
+        "\\fp",
+        "\\sf",
+        "\\sfz",
+        "\\<",
+        "\\>",
+        "\\cresc",
+    }
 
     def __init__(self, text):
         if text is None:
-            text = ''
-        self.text = {text}
+            text = ""
+        # a dict rather than a set, so that the text is written in the order it was added whatever the hash seed of
+        # the process (parts and chunks of measures are converted in other processes)
+        self.text = {text: None}
 
     def add(self, new):
-        if new == '' or new is None:
+        if new == "" or new is None:
             return
-        self.text.add(new)
-        if self.text.intersection(self.dynamics):
-            self.text.discard("\\!")
+        self.text[new] = None
+        if not self.dynamics.isdisjoint(self.text):
+            self.text.pop("\\!", None)
 
     def __str__(self):
-        return ''.join(self.text)
+        return "".join(self.text)
@@ -1,21 +1,22 @@
+import hashlib
 import warnings
+from fractions import Fraction
 from expression import Expression
 from note import Note
 import note
+from profiling import null_span
+import tables
+import xmlbackend
 
 
 def add_note(
     new_note,
-    instrument_strs,
     expression_buffer,
     measure_strs,
+    voice_split_idx,
     remaining_backup_duration,
 ):
-    if new_note.should_end_cue:
-        for s in reversed(instrument_strs):
-            if isinstance(s, Note):
-                s.end_cue = " } "
-                break
+    # voice_split_idx is the index of the "} \\ {" marker of the current backup in measure_strs
     in_cue = new_note.in_cue
     new_note.add_expression(expression_buffer)
     expression_buffer = new_note.next_expression_buffer
@@ -25,34 +26,20 @@ def add_note(
             remaining_backup_duration -= new_note.duration_num
             if remaining_backup_duration == 0:
                 new_note.end_poly = "} >>"
-                # if there are no notes in the second voice, replace "} \\ {" with "} {" to avoid
+                # if there are no notes (outside a cue) in the second voice, replace "} \\ {" with "} {" to avoid
                 # issues with ties not being able to reach into the polyphonic section
-                rev_idx = 0
-                found_notes = False
-                for s in reversed(measure_strs):
-                    rev_idx -= 1
-                    if isinstance(s, Note) and s.pitch != ["s"]:
-                        found_notes = True
-                    elif s == "} \\\\ {":
-                        if not found_notes:
-                            measure_strs[rev_idx] = "} {"
-                        else:
-                            new_voice_idx = rev_idx
-                        break
                 poly_in_cue = False
-                if found_notes:
-                    found_notes = False
-                    for s in measure_strs[new_voice_idx:]:
-                        if isinstance(s, Note):
-                            if s.start_cue != "":
-                                poly_in_cue = True
-                            if s.end_cue != "":
-                                poly_in_cue = False
-                            if s.pitch != ["s"] and not poly_in_cue:
-                                found_notes = True
-                                break
-                    if not found_notes:
-                        measure_strs[new_voice_idx] = "} {"
+                for idx in range(voice_split_idx + 1, len(measure_strs)):
+                    s = measure_strs[idx]
+                    if isinstance(s, Note):
+                        if s.start_cue != "":
+                            poly_in_cue = True
+                        if s.end_cue != "":
+                            poly_in_cue = False
+                        if s.pitch != ["s"] and not poly_in_cue:
+                            break
+                else:
+                    measure_strs[voice_split_idx] = "} {"
         if remaining_backup_duration < 0:
             raise ImportError("Backup duration surpassed")
     else:
@@ -62,63 +49,264 @@ def add_note(
 
 
 def replace_with_extended_rests(
-    instrument_strs, extended_rest_measure_duration, n_measures_extended_rest, time_info
+    instrument_strs, rest_idxs, extended_rest_measure_duration
 ):
-    instrument_strs_idx = -1
-    first_rest_idx = None
-    last_rest_idx = None
-    n_measures_counted = 0
-    extended_rest_measure_note = Note(
-        None,
-        time_info,
-        in_cue=False,
-        cue=False,
-        pitch=["R"],
-        duration_num=extended_rest_measure_duration,
-    )
-    for s in reversed(instrument_strs[:-1]):
-        instrument_strs_idx -= 1
-        if isinstance(s, Note):
-            if s == extended_rest_measure_note:
-                first_rest_idx = instrument_strs_idx
-                n_measures_counted += 1
-                if last_rest_idx is None:
-                    last_rest_idx = instrument_strs_idx
-            if n_measures_counted == n_measures_extended_rest:
-                break
-    assert n_measures_counted == n_measures_extended_rest
-    assert first_rest_idx is not None
-    assert last_rest_idx is not None
-    last_note = instrument_strs[first_rest_idx]
-    last_note.duration_num = n_measures_extended_rest * extended_rest_measure_duration
-    last_note.duration = note.duration_num_to_str(
-        last_note.duration_num, extended_rest_measure_duration
+    # rest_idxs are the indices in instrument_strs of the full-measure rests of one run, recorded as they were appended
+    first_rest_idx = rest_idxs[0]
+    last_rest_idx = rest_idxs[-1]
+    first_note = instrument_strs[first_rest_idx]
+    assert isinstance(first_note, Note)
+    first_note.duration_num = len(rest_idxs) * extended_rest_measure_duration
+    first_note.duration = note.duration_num_to_str(
+        first_note.duration_num, extended_rest_measure_duration
     )
     instrument_strs[first_rest_idx + 1 : last_rest_idx + 1] = []
+    return first_note
+
+
+min_chunk_measures = 32  # parts are not split into chunks of fewer measures than this
+
+
+def parse_measure_chunk(full_name, measure_xmls, state, debug):
+    """
+    Parse serialized measures from the given state, in a worker process. Returns the results (ending with None if the
+    part turns out to be percussion), the state after the last measure and whether the part is percussion, which the
+    Instrument in the parent process takes over (see Instrument.skip_percussion).
+    """
+    parser = Instrument.__new__(Instrument)
+    parser.full_name = full_name
+    parser.percussion = False
+    results = []
+    for measure_xml in measure_xmls:
+        result = parser.parse_measure(xmlbackend.fromstring(measure_xml), state, debug)
+        results.append(result)
+        if result is None:
+            break
+    return results, state, parser.percussion
+
+
+def prescan_measure(measure, state):
+    """
+    Quickly update state past a measure, reading only the attributes, cue marks, full-measure rests and the
+    elements that end a rest run, without building any notes. Returns whether the new state is reliable: it is not
+    when the measure ends with a direction, whose text would be pending for the next note, or with a backup. The
+    rest run count is a guess, since telling a full-measure rest apart needs the whole note.
+    """
+    divisions = state.divisions
+    measure_duration = state.measure_duration
+    time_info = state.time_info
+    in_cue = state.in_cue
+    n_measures_current_rest = state.n_measures_current_rest
+    reliable = True
+    end_rest_run_after = False
+    for measure_child in measure:
+        match measure_child.tag:
+            case "note":
+                reliable = True
+                if measure_child.find("chord") is not None:
+                    continue
+                in_cue = measure_child.find("cue") is not None
+                rest = measure_child.find("rest")
+                if rest is not None and rest.get("measure") == "yes" and not in_cue:
+                    n_measures_current_rest += 1
+                else:
+                    n_measures_current_rest = 0
+            case "forward":
+                n_measures_current_rest = 0
+            case "attributes":
+                for attribute_child in measure_child:
+                    match attribute_child.tag:
+                        case "divisions":
+                            divisions = int(attribute_child.text) * 4
+                        case "time":
+                            measure_duration = Fraction(
+                                int(attribute_child.findtext("beats")),
+                                int(attribute_child.findtext("beat-type")),
+                            )
+                            time_info = (divisions, measure_duration)
+                            n_measures_current_rest = 0
+                        case "key" | "clef":
+                            n_measures_current_rest = 0
+            case "direction" | "backup":
+                reliable = False
+                n_measures_current_rest = 0
+            case "barline":
+                repeat = measure_child.find("repeat")
+                if repeat is not None and repeat.get("direction") == "forward":
+                    n_measures_current_rest = 0
+                else:
+                    end_rest_run_after = True
+    if end_rest_run_after:
+        n_measures_current_rest = 0
+    if measure_duration != state.measure_duration:
+        state.rest_key = note.measure_rest_key(measure_duration)
+    state.divisions = divisions
+    state.measure_duration = measure_duration
+    state.time_info = time_info
+    state.in_cue = in_cue
+    state.expression = None
+    state.n_measures_current_rest = n_measures_current_rest
+    state.first_measure = False
+    state._key = None
+    return reliable
+
+
+def is_percussion(instrument_element):
+    """Whether a <part> has a percussion clef, in which case Instrument skips it. Much cheaper than converting it"""
+    return any(
+        sign.text == "percussion"
+        for sign in instrument_element.iterfind("measure/attributes/clef/sign")
+    )
+
+
+def element_fingerprint(element):
+    """
+    The tags, attributes, text and number of children of an element and its descendants in document order, as bytes.
+    Cheaper to build than tostring and, with the numbers of children, only identical for identical XML.
+    """
+    return "\x00".join(
+        [
+            f"{el.tag}\x01{el.attrib}\x01{el.text}\x01{el.tail}\x01{len(el)}"
+            for el in element.iter()
+        ]
+    ).encode()
+
+
+class MeasureState:
+    """
+    Everything parsing a measure needs to know about the measures before it. It is a plain value that can be
+    compared and pickled, so it serves as the checkpoint from which conversion can resume at any measure.
+    """
+
+    fields = (
+        "divisions",
+        "measure_duration",
+        "time_info",
+        "rest_key",
+        "in_cue",
+        "expression",  # texts of the pending expression buffer, in order, or None
+        "n_measures_current_rest",
+        "first_measure",
+        "pickup_idx",
+        "pickup_duration",
+    )
+    __slots__ = fields + ("_key",)
+
+    def __init__(self):
+        self.divisions = 4
+        self.measure_duration = Fraction(1)
+        self.time_info = (self.divisions, self.measure_duration)
+        self.rest_key = note.measure_rest_key(self.measure_duration)
+        self.in_cue = False
+        self.expression = None
+        self.n_measures_current_rest = 0
+        self.first_measure = True
+        self.pickup_idx = -1
+        self.pickup_duration = Fraction(0)
+        self._key = None
+
+    @classmethod
+    def continued(cls):
+        """The state at the start of a measure that is converted without the measures before it, with no pickup"""
+        state = cls()
+        state.first_measure = False
+        state.pickup_idx = 0
+        return state
+
+    def key(self):
+        """A digest of the fields, computed once for each state since it is looked up for every measure"""
+        if self._key is None:
+            fields = repr(tuple(getattr(self, field) for field in self.fields))
+            self._key = hashlib.blake2b(fields.encode(), digest_size=16).digest()
+        return self._key
+
+    def copy(self):
+        state = MeasureState.__new__(MeasureState)
+        for field in self.__slots__:
+            setattr(state, field, getattr(self, field))
+        return state
+
+    def __eq__(self, other):
+        if not isinstance(other, MeasureState):
+            return False
+        return self.key() == other.key()
+
+
+class MeasureResult:
+    """
+    A parsed measure: its strings and notes, and what has to happen to the notes of earlier measures when it is
+    appended to the part (ending a cue, collapsing a run of full-measure rests).
+    """
+
+    __slots__ = (
+        "measure_num",
+        "measure_strs",
+        "ends_cue",
+        "end_extended_rest",
+        "n_measures_extended_rest",
+        "extended_rest_measure_duration",
+        "rest_positions",  # indices in measure_strs of the counted full-measure rests
+        "end_extended_rest_after",
+        "n_measures_rest_run",
+        "measure_duration",
+    )
+
+    def __init__(
+        self,
+        measure_num,
+        measure_strs,
+        ends_cue,
+        end_extended_rest,
+        n_measures_extended_rest,
+        extended_rest_measure_duration,
+        rest_positions,
+        end_extended_rest_after,
+        n_measures_rest_run,
+        measure_duration,
+    ):
+        self.measure_num = measure_num
+        self.measure_strs = measure_strs
+        self.ends_cue = ends_cue
+        self.end_extended_rest = end_extended_rest
+        self.n_measures_extended_rest = n_measures_extended_rest
+        self.extended_rest_measure_duration = extended_rest_measure_duration
+        self.rest_positions = rest_positions
+        self.end_extended_rest_after = end_extended_rest_after
+        self.n_measures_rest_run = n_measures_rest_run
+        self.measure_duration = measure_duration
+
+    def copy(self):
+        """A copy whose notes can be modified while appending it without changing this one"""
+        result = MeasureResult.__new__(MeasureResult)
+        for field in self.__slots__:
+            setattr(result, field, getattr(self, field))
+        result.measure_strs = [
+            s.copy() if isinstance(s, Note) else s for s in self.measure_strs
+        ]
+        return result
 
 
 class Instrument:
-    def __init__(self, instrument_element, part_list, debug):
-        key_dict = {
-            "0": "c",
-            "1": "g",
-            "2": "d",
-            "3": "a",
-            "4": "e",
-            "5": "b",
-            "6": "fs",
-            "7": "cs",
-            "-1": "f",
-            "-2": "bf",
-            "-3": "ef",
-            "-4": "af",
-            "-5": "df",
-            "-6": "gf",
-            "-7": "cf",
-        }
-        divisions = 4
-        measure_duration = 1
-        time_info = (divisions, measure_duration)
+    key_dict = tables.key_names
+
+    def __init__(
+        self,
+        instrument_element,
+        part_list,
+        debug,
+        checkpoints=None,
+        jobs=1,
+        start_state=None,
+        profiler=None,
+    ):
+        """
+        Convert a <part> element. If checkpoints is given (the checkpoints of a previous conversion of this part, or
+        an empty dict), measures whose XML and incoming state are unchanged are taken from it instead of being
+        parsed again, and the checkpoints of this conversion are kept in self.checkpoints. Otherwise, with more than
+        one job, chunks of measures are parsed in parallel worker processes. The first measure is parsed from
+        start_state if it is given, and from the state at the start of a part otherwise. A Profiler records the
+        time taken by each measure, by building its notes, by collapsing rests and by joining the strings.
+        """
         self.id = instrument_element.get("id")
         part = [part for part in part_list if part.get("id") == self.id][0]
         self.full_name = part.find("part-name").text
@@ -130,424 +318,605 @@ class Instrument:
             + " = \\compressMMRests {\n\\accidentalStyle Score.modern-cautionary\n"
         ]
         last_chord = None
-        remaining_backup_duration = 0
-        expression_buffer = Expression("")
-        in_cue = False
-        n_measures_extended_rest = 0
-        n_measures_current_rest = 0
-        end_extended_rest = False
-        end_extended_rest_after = False  # only triggered by barlines
-        extended_rest_measure_duration = measure_duration
+        last_note = None
+        rest_idxs = []  # indices of the counted full-measure rests in instrument_strs
         self.percussion = False
-        pickup_idx = -1
-        pickup_duration = 0
-        first_measure = True
+        self.n_measures = 0
+        self.n_measures_reused = 0
+        self.checkpoints = {} if checkpoints is not None else None
 
         if debug:
             print(f"Start parsing instrument: {self.full_name} ({self.id})")
+        if jobs > 1 and checkpoints is None and start_state is None:
+            measure_results = self.parse_measures_in_parallel(
+                instrument_element, debug, jobs, profiler
+            )
+        else:
+            measure_results = self.parse_measures(
+                instrument_element, debug, checkpoints, start_state, profiler
+            )
+        span = null_span
+        if profiler is not None:
+            span = profiler.span
+            measure_results = profiler.iterate(
+                measure_results,
+                "measure",
+                "measure",
+                lambda result: {"part": self.id, "number": result.measure_num},
+            )
+        for result in measure_results:
+            if result is None:
+                return
+            self.n_measures += 1
+
+            if int(result.measure_num) % 4 == 1:  # new line every 4 measures
+                instrument_strs.append(f"% Measure {result.measure_num}\n")
+
+            if result.ends_cue and last_note is not None:
+                last_note.end_cue = " } "
+
+            if result.end_extended_rest:
+                n_measures_extended_rest = result.n_measures_extended_rest
+                if n_measures_extended_rest > 1:
+                    assert len(rest_idxs) >= n_measures_extended_rest
+                    last_rest = instrument_strs[rest_idxs[-1]]
+                    with span("rest_compression"):
+                        merged_rest = replace_with_extended_rests(
+                            instrument_strs,
+                            rest_idxs[-n_measures_extended_rest:],
+                            result.extended_rest_measure_duration,
+                        )
+                    if last_note is last_rest:
+                        last_note = merged_rest
+                rest_idxs.clear()
+
+            for measure_idx, s in enumerate(result.measure_strs):
+                instrument_strs.append(" ")
+                if isinstance(s, Note) and s.same_chord(last_chord):
+                    s.pitch = ["q"]
+                elif isinstance(s, Note) and s.chord:
+                    last_chord = s
+                if isinstance(s, Note):
+                    last_note = s
+                if measure_idx in result.rest_positions:
+                    rest_idxs.append(len(instrument_strs))
+                instrument_strs.append(s)
+
+            if result.end_extended_rest_after:
+                n_measures_rest_run = result.n_measures_rest_run
+                if n_measures_rest_run > 1:
+                    assert len(rest_idxs) >= n_measures_rest_run
+                    last_rest = instrument_strs[rest_idxs[-1]]
+                    with span("rest_compression"):
+                        merged_rest = replace_with_extended_rests(
+                            instrument_strs,
+                            rest_idxs[-n_measures_rest_run:],
+                            result.measure_duration,
+                        )
+                    if last_note is last_rest:
+                        last_note = merged_rest
+                rest_idxs.clear()
+
+            instrument_strs.append("|\n")
+        instrument_strs.append("}")
+        if debug:
+            cache_info = note.duration_num_to_str.cache_info()
+            print(
+                f"Done parsing instrument: {self.full_name} ({self.id}), duration cache: "
+                f"{cache_info.hits} hits, {cache_info.misses} misses, "
+                f"{cache_info.currsize}/{cache_info.maxsize} entries"
+            )
+        with span("string_emission"):
+            self.instrument_str = "".join([str(s) for s in instrument_strs])
+        if profiler is not None:
+            profiler.count("measures", self.n_measures)
+            profiler.count("measures_reused", self.n_measures_reused)
+            profiler.count(
+                "notes", sum(1 for s in instrument_strs if isinstance(s, Note))
+            )
+        self.full_name_var = self.var_name + "_name"
+        self.short_name_var = self.var_name + "_short_name"
+        self.name_str = f"""{self.full_name_var} = "{self.full_name}"\n{self.short_name_var} = "{self.full_name}"\n"""
+        self.book_str = f"\\book {{ \\bookOutputSuffix \\{self.var_name}_name  \\header {{ instrument = \\{self.var_name}_name }}  \\score {{ \\{self.var_name} }} }}\n"
+        self.book_part_str = f"\\bookpart {{ \\header {{ instrument = \\{self.var_name}_name }}  \\score {{ \\{self.var_name} }} }}\n"
+
+    def music_digest(self):
+        """A digest of the converted music, the same for parts with identical music whatever their names"""
+        return hashlib.blake2b(
+            self.instrument_str[len(self.var_name) :].encode(), digest_size=16
+        ).digest()
+
+    def share(self, music_var):
+        """Refer to the LilyPond variable music_var, of a part with the same music, instead of holding a copy"""
+        self.instrument_str = f"{self.var_name} = \\{music_var}"
+
+    def parse_measures(
+        self,
+        instrument_element,
+        debug,
+        checkpoints=None,
+        start_state=None,
+        profiler=None,
+    ):
+        """Yield the MeasureResult of each measure in order, or None once the part turns out to be percussion"""
+        state = MeasureState() if start_state is None else start_state.copy()
         for measure in instrument_element:
             assert measure.tag == "measure"
-            measure_strs = []
-            measure_num = measure.get("number")
-            if debug:
-                print(f"Start parsing measure: {measure_num}")
-            if int(measure_num) % 4 == 1:  # new line every 4 measures
-                instrument_strs.append(f"% Measure {measure_num}\n")
-            extended_rest_measure_duration = measure_duration
-            for measure_child in measure:
-                measure_rest_note = Note(
-                    None,
-                    time_info,
-                    in_cue=False,
-                    cue=False,
-                    pitch=["R"],
-                    duration_num=measure_duration,
+            if checkpoints is None:
+                yield self.parse_measure(measure, state, debug, profiler)
+                continue
+            checkpoint_key = (
+                hashlib.blake2b(element_fingerprint(measure), digest_size=16).digest(),
+                state.key(),
+            )
+            checkpoint = checkpoints.get(checkpoint_key)
+            if checkpoint is None:
+                result = self.parse_measure(measure, state, debug, profiler)
+                if result is None:
+                    yield None
+                    return
+                state.key()  # stored with the copy, so it is not recomputed when the checkpoint is reused
+                self.checkpoints[checkpoint_key] = (result.copy(), state.copy())
+            else:
+                if debug:
+                    print(f"Reusing measure: {measure.get('number')}")
+                self.n_measures_reused += 1
+                self.checkpoints[checkpoint_key] = checkpoint
+                result = checkpoint[0].copy()
+                state = checkpoint[1].copy()
+            yield result
+
+    def parse_measures_in_parallel(
+        self, instrument_element, debug, jobs, profiler=None
+    ):
+        """
+        Yield the same results as parse_measures, parsing chunks of measures in a pool of worker processes.
+
+        A quick first pass (prescan_measure) guesses the state at the start of each measure, and each chunk is parsed
+        from the guess at its start. The first chunk starts from the known initial state, and the exact state at the
+        end of each chunk is compared with the guess the next chunk started from: if they differ, that chunk is
+        parsed again here, so the results are always the same as parsing the measures one after another.
+        """
+        measures = list(instrument_element)
+        n_chunks = min(jobs, len(measures) // min_chunk_measures)
+        if n_chunks < 2:
+            yield from self.parse_measures(instrument_element, debug, profiler=profiler)
+            return
+
+        # guess the state at the start of every measure, parsing the first measure fully since it decides the pickup
+        state = MeasureState()
+        first_result = self.parse_measure(measures[0], state, debug, profiler)
+        if first_result is None:
+            yield None
+            return
+        guesses = [None, state.copy()]
+        reliable = [False, True]
+        for measure in measures[1:-1]:
+            reliable.append(prescan_measure(measure, state))
+            guesses.append(state.copy())
+
+        # start each chunk at a measure whose guessed state is reliable, near an even split of the part
+        chunk_starts = [1]
+        for chunk_idx in range(1, n_chunks):
+            start = max(chunk_idx * len(measures) // n_chunks, chunk_starts[-1] + 1)
+            while start < len(measures) and not reliable[start]:
+                start += 1
+            if start < len(measures):
+                chunk_starts.append(start)
+        chunk_ends = chunk_starts[1:] + [len(measures)]
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(
+                    parse_measure_chunk,
+                    self.full_name,
+                    [xmlbackend.tostring(measure) for measure in measures[start:end]],
+                    guesses[start],
+                    debug,
                 )
-                match measure_child.tag:
-                    case "forward" | "note":
-                        if measure_child.tag == "note":
+                for start, end in zip(chunk_starts[1:], chunk_ends[1:])
+            ]
+            yield first_result
+            state = guesses[1]
+            for chunk_idx, (start, end) in enumerate(zip(chunk_starts, chunk_ends)):
+                if chunk_idx == 0:
+                    results = None
+                else:
+                    results, end_state, percussion = futures[chunk_idx - 1].result()
+                    if state != guesses[start]:
+                        results = None
+                        if debug:
+                            print(
+                                f"State guessed for measure {measures[start].get('number')} was wrong"
+                            )
+                if results is None:
+                    # parse the chunk here, from the exact state at its start
+                    for measure in measures[start:end]:
+                        result = self.parse_measure(measure, state, debug, profiler)
+                        yield result
+                        if result is None:
+                            return
+                    continue
+                if percussion:
+                    self.skip_percussion()
+                yield from results
+                state = end_state
+
+    def skip_percussion(self):
+        """Mark the part as percussion, which is not converted"""
+        warnings.warn("Skipping percussion clef instrument " + self.full_name)
+        self.percussion = True
+
+    def parse_measure(self, measure, state, debug, profiler=None):
+        """
+        Parse a measure, starting from the state left by the previous measure, and update the state for the next
+        one. Returns the MeasureResult, or None if the part turns out to be percussion. A Profiler records the time
+        taken to build each note from its element (note_construction).
+        """
+        divisions = state.divisions
+        measure_duration = state.measure_duration
+        time_info = state.time_info
+        rest_key = state.rest_key
+        in_cue = state.in_cue
+        expression_buffer = None
+        if state.expression is not None:
+            expression_buffer = Expression("")
+            expression_buffer.text = dict.fromkeys(state.expression)
+        n_measures_current_rest = state.n_measures_current_rest
+        first_measure = state.first_measure
+        pickup_idx = state.pickup_idx
+        pickup_duration = state.pickup_duration
+
+        measure_strs = []
+        measure_num = measure.get("number")
+        if debug:
+            print(f"Start parsing measure: {measure_num}")
+        remaining_backup_duration = 0
+        voice_split_idx = None
+        ends_cue = False
+        rest_positions = []
+        end_extended_rest = False
+        n_measures_extended_rest = 0
+        end_extended_rest_after = False  # only triggered by barlines
+        extended_rest_measure_duration = measure_duration
+
+        for measure_child in measure:
+            match measure_child.tag:
+                case "forward" | "note":
+                    if measure_child.tag == "note":
+                        if profiler is None:
                             new_note = Note(
                                 measure_child, time_info, measure_num, in_cue=in_cue
                             )
                         else:
-                            duration = (
-                                int(measure_child.find("duration").text) / divisions
-                            )
-                            new_note = Note(
-                                None,
-                                time_info,
-                                in_cue=in_cue,
-                                cue=in_cue,
-                                pitch=["s"],
-                                duration_num=duration,
-                            )
-                        if (
-                            first_measure
-                            and not new_note.chord
-                            and remaining_backup_duration == 0
-                        ):
-                            pickup_duration += new_note.duration_num
-                        ret = add_note(
-                            new_note,
-                            instrument_strs,
-                            expression_buffer,
-                            measure_strs,
-                            remaining_backup_duration,
+                            with profiler.span("note_construction"):
+                                new_note = Note(
+                                    measure_child, time_info, measure_num, in_cue=in_cue
+                                )
+                    else:
+                        duration = Fraction(
+                            int(measure_child.find("duration").text), divisions
                         )
-                        if new_note == measure_rest_note:
-                            n_measures_current_rest += 1
-                        else:
-                            if n_measures_current_rest > 0:
-                                end_extended_rest = True
-                                n_measures_extended_rest = n_measures_current_rest
-                                n_measures_current_rest = 0
-                        expression_buffer, remaining_backup_duration, in_cue = ret
-                    case "attributes":
-                        for attribute_child in measure_child:
-                            match attribute_child.tag:
-                                case "divisions":
-                                    divisions = (
-                                        int(measure_child.find("divisions").text) * 4
-                                    )
-                                case "key":
-                                    key = key_dict[
-                                        measure_child.find("key").find("fifths").text
-                                    ]
-                                    measure_strs.append(f"\\key {key} \\major")
-                                    if n_measures_current_rest > 0:
-                                        end_extended_rest = True
-                                        n_measures_extended_rest = (
-                                            n_measures_current_rest
+                        new_note = Note(
+                            None,
+                            time_info,
+                            in_cue=in_cue,
+                            cue=in_cue,
+                            pitch=["s"],
+                            duration_num=duration,
+                        )
+                    if (
+                        first_measure
+                        and not new_note.chord
+                        and remaining_backup_duration == 0
+                    ):
+                        pickup_duration += new_note.duration_num
+                    ret = add_note(
+                        new_note,
+                        expression_buffer,
+                        measure_strs,
+                        voice_split_idx,
+                        remaining_backup_duration,
+                    )
+                    if new_note.should_end_cue:
+                        ends_cue = True
+                    if new_note.is_measure_rest(rest_key):
+                        n_measures_current_rest += 1
+                        rest_positions.append(len(measure_strs) - 1)
+                    else:
+                        if n_measures_current_rest > 0:
+                            end_extended_rest = True
+                            n_measures_extended_rest = n_measures_current_rest
+                            n_measures_current_rest = 0
+                    expression_buffer, remaining_backup_duration, in_cue = ret
+                case "attributes":
+                    for attribute_child in measure_child:
+                        match attribute_child.tag:
+                            case "divisions":
+                                divisions = int(attribute_child.text) * 4
+                            case "key":
+                                key = self.key_dict[attribute_child.findtext("fifths")]
+                                measure_strs.append(f"\\key {key} \\major")
+                                if n_measures_current_rest > 0:
+                                    end_extended_rest = True
+                                    n_measures_extended_rest = n_measures_current_rest
+                                    n_measures_current_rest = 0
+                            case "time":
+                                time_num = int(attribute_child.findtext("beats"))
+                                time_den = int(attribute_child.findtext("beat-type"))
+                                measure_duration = Fraction(time_num, time_den)
+                                time_info = (divisions, measure_duration)
+                                rest_key = note.measure_rest_key(measure_duration)
+                                measure_strs.append(f"\\time {time_num}/{time_den}")
+                                if pickup_idx == -1:
+                                    pickup_idx = len(measure_strs)
+                                    measure_strs.append(f"\\partial ")
+                                if n_measures_current_rest > 0:
+                                    end_extended_rest = True
+                                    n_measures_extended_rest = n_measures_current_rest
+                                    n_measures_current_rest = 0
+                            case "clef":
+                                clef = attribute_child.findtext("sign")
+                                if clef == "percussion":
+                                    self.skip_percussion()
+                                    return
+                                octave_change = attribute_child.findtext(
+                                    "clef-octave-change"
+                                )
+                                if octave_change is not None:
+                                    if octave_change == "-1":
+                                        if clef == "G":
+                                            clef = "GG"
+                                        else:
+                                            clef = f'"{clef}_8"'
+                                    else:
+                                        warnings.warn(
+                                            "Skipping clef octave change for instrument "
+                                            + self.full_name
                                         )
-                                        n_measures_current_rest = 0
-                                case "time":
-                                    time_num = int(
-                                        measure_child.find("time").find("beats").text
-                                    )
-                                    time_den = int(
-                                        measure_child.find("time")
-                                        .find("beat-type")
-                                        .text
+
+                                measure_strs.append(f"\\clef {clef}")
+                                if n_measures_current_rest > 0:
+                                    end_extended_rest = True
+                                    n_measures_extended_rest = n_measures_current_rest
+                                    n_measures_current_rest = 0
+                            case "measure-style":
+                                if attribute_child.find("multiple-rest") is not None:
+                                    continue
+                                else:
+                                    raise ImportError(
+                                        "Unrecognized attribute: " + attribute_child.tag
                                     )
-                                    measure_duration = time_num / time_den
-                                    time_info = (divisions, measure_duration)
-                                    measure_strs.append(f"\\time {time_num}/{time_den}")
-                                    if pickup_idx == -1:
-                                        pickup_idx = len(measure_strs)
-                                        measure_strs.append(f"\\partial ")
-                                    if n_measures_current_rest > 0:
-                                        end_extended_rest = True
-                                        n_measures_extended_rest = (
-                                            n_measures_current_rest
-                                        )
-                                        n_measures_current_rest = 0
-                                case "clef":
-                                    clef = attribute_child.find("sign").text
-                                    if clef == "percussion":
+                            case "transpose":
+                                # this is relevant only for the difference between sounded and written
+                                warnings.warn(
+                                    f'Skipping part transposition for instrument "{self.full_name}"'
+                                )
+                                pass
+                            case "staves" | "staff-details":
+                                # I don't know what these are
+                                warnings.warn(
+                                    f'Unimplemented attribute "{attribute_child.tag}" in mm. {measure_num}'
+                                )
+                                pass
+                            case "for-part":
+                                for forpart_child in attribute_child:
+                                    if forpart_child.tag == "part-transpose":
+                                        # this is relevant only for the difference between sounded and written
                                         warnings.warn(
-                                            "Skipping percussion clef instrument "
-                                            + self.full_name
+                                            f'Skipping part transposition for instrument "{self.full_name}"'
                                         )
-                                        self.percussion = True
-                                        return
-                                    if (
-                                        attribute_child.find("clef-octave-change")
-                                        is not None
-                                    ):
-                                        if (
-                                            attribute_child.find(
-                                                "clef-octave-change"
-                                            ).text
-                                            == "-1"
-                                        ):
-                                            if clef == "G":
-                                                clef = "GG"
-                                            else:
-                                                clef = f'"{clef}_8"'
-                                        else:
-                                            warnings.warn(
-                                                "Skipping clef octave change for instrument "
-                                                + self.full_name
-                                            )
-
-                                    measure_strs.append(f"\\clef {clef}")
-                                    if n_measures_current_rest > 0:
-                                        end_extended_rest = True
-                                        n_measures_extended_rest = (
-                                            n_measures_current_rest
+                                    else:
+                                        raise ImportError(
+                                            "Unrecognized for-part attribute: "
+                                            + forpart_child.tag
+                                        )
+                            case _:
+                                raise ImportError(
+                                    "Unrecognized attribute: " + attribute_child.tag
+                                )
+                case "direction":
+                    if n_measures_current_rest > 0:
+                        end_extended_rest = True
+                        n_measures_extended_rest = n_measures_current_rest
+                        n_measures_current_rest = 0
+                    for direction_child in measure_child:
+                        if direction_child.tag not in [
+                            "direction-type",
+                            "sound",
+                            "voice",
+                            "staff",
+                        ]:
+                            if direction_child.tag == "offset":
+                                warnings.warn(
+                                    f'Ignoring "{direction_child.tag}" in mm. {measure_num}'
+                                )
+                            else:
+                                raise ImportError(
+                                    "Unrecognized direction: " + direction_child.tag
+                                )
+                        if (
+                            direction_child.tag == "voice"
+                            and direction_child.text != "1"
+                        ):
+                            raise ImportError(
+                                "Multiple voices in measure: " + measure_num
+                            )
+                        for direction_type_child in direction_child:
+                            this_buffer = ""
+                            match direction_type_child.tag:
+                                case "dynamics":
+                                    for dynamic in direction_type_child:
+                                        assert dynamic.tag in tables.dynamics
+                                        this_buffer = "\\" + dynamic.tag
+                                case "wedge":
+                                    this_buffer = tables.wedges[
+                                        direction_type_child.get("type")
+                                    ]
+                                case "words":
+                                    text = direction_type_child.text
+                                    if text in ["cresc."]:
+                                        this_buffer = "\\cresc"
+                                    else:
+                                        this_buffer = (
+                                            '-\\markup{\\italic "' + text + '"}'
                                         )
-                                        n_measures_current_rest = 0
-                                case "measure-style":
+                                case "dashes":
+                                    if direction_type_child.get("type") == "stop":
+                                        this_buffer = "\\!"
+                                case "metronome":
+                                    beat_unit = Note.duration_dict[
+                                        direction_type_child.find("beat-unit").text
+                                    ]
                                     if (
-                                        attribute_child.find("multiple-rest")
+                                        direction_type_child.find("beat-unit-dot")
                                         is not None
                                     ):
-                                        continue
+                                        beat_unit += "."
+                                    tempo = direction_type_child.find("per-minute").text
+                                    measure_strs.append(
+                                        f"\\tempo {beat_unit} = {tempo}"
+                                    )
+                                case "octave-shift":
+                                    shift_amount = direction_type_child.get("number")
+                                    if direction_type_child.get("type") == "up":
+                                        shift_amount = "-" + shift_amount
+                                    elif direction_type_child.get("type") == "stop":
+                                        shift_amount = "0"
+                                    elif direction_type_child.get("type") == "down":
+                                        pass
                                     else:
                                         raise ImportError(
-                                            "Unrecognized attribute: "
-                                            + attribute_child.tag
+                                            "Unrecognized octave shift details"
                                         )
-                                case "transpose":
-                                    # this is relevant only for the difference between sounded and written
-                                    warnings.warn(
-                                        f'Skipping part transposition for instrument "{self.full_name}"'
-                                    )
-                                    pass
-                                case "staves" | "staff-details":
-                                    # I don't know what these are
-                                    warnings.warn(
-                                        f'Unimplemented attribute "{attribute_child.tag}" in mm. {measure_num}'
-                                    )
-                                    pass
-                                case "for-part":
-                                    for forpart_child in attribute_child:
-                                        if forpart_child.tag == "part-transpose":
-                                            # this is relevant only for the difference between sounded and written
-                                            warnings.warn(
-                                                f'Skipping part transposition for instrument "{self.full_name}"'
-                                            )
-                                        else:
-                                            raise ImportError(
-                                                "Unrecognized for-part attribute: "
-                                                + forpart_child.tag
-                                            )
+                                    measure_strs.append(f"\\ottava #{shift_amount} ")
                                 case _:
                                     raise ImportError(
-                                        "Unrecognized attribute: " + attribute_child.tag
+                                        "Unrecognized direction type: "
+                                        + direction_type_child.tag
                                     )
-                    case "direction":
-                        if n_measures_current_rest > 0:
-                            end_extended_rest = True
-                            n_measures_extended_rest = n_measures_current_rest
-                            n_measures_current_rest = 0
-                        for direction_child in measure_child:
-                            if direction_child.tag not in [
-                                "direction-type",
-                                "sound",
-                                "voice",
-                                "staff",
-                            ]:
-                                if direction_child.tag == "offset":
-                                    warnings.warn(
-                                        f'Ignoring "{direction_child.tag}" in mm. {measure_num}'
-                                    )
-                                else:
-                                    raise ImportError(
-                                        "Unrecognized direction: " + direction_child.tag
-                                    )
-                            if (
-                                direction_child.tag == "voice"
-                                and direction_child.text != "1"
-                            ):
-                                raise ImportError(
-                                    "Multiple voices in measure: " + measure_num
-                                )
-                            for direction_type_child in direction_child:
-                                this_buffer = ""
-                                match direction_type_child.tag:
-                                    case "dynamics":
-                                        for dynamic in direction_type_child:
-                                            assert dynamic.tag in [
-                                                "pp",
-                                                "p",
-                                                "mp",
-                                                "mf",
-                                                "f",
-                                                "ff",
-                                                "fp",
-                                                "sf",
-                                                "sfz",
-                                            ]
-                                            this_buffer = "\\" + dynamic.tag
-                                    case "wedge":
-                                        wedge_dict = {
-                                            "crescendo": "\\<",
-                                            "diminuendo": "\\>",
-                                            "stop": "\\!",
-                                        }
-                                        this_buffer = wedge_dict[
-                                            direction_type_child.get("type")
-                                        ]
-                                    case "words":
-                                        text = direction_type_child.text
-                                        if text in ["cresc."]:
-                                            this_buffer = "\\cresc"
-                                        else:
-                                            this_buffer = (
-                                                '-\\markup{\\italic "' + text + '"}'
-                                            )
-                                    case "dashes":
-                                        if direction_type_child.get("type") == "stop":
-                                            this_buffer = "\\!"
-                                    case "metronome":
-                                        beat_unit = Note.duration_dict[
-                                            direction_type_child.find("beat-unit").text
-                                        ]
-                                        if (
-                                            direction_type_child.find("beat-unit-dot")
-                                            is not None
-                                        ):
-                                            beat_unit += "."
-                                        tempo = direction_type_child.find(
-                                            "per-minute"
-                                        ).text
-                                        measure_strs.append(
-                                            f"\\tempo {beat_unit} = {tempo}"
-                                        )
-                                    case "octave-shift":
-                                        shift_amount = direction_type_child.get(
-                                            "number"
-                                        )
-                                        if direction_type_child.get("type") == "up":
-                                            shift_amount = "-" + shift_amount
-                                        elif direction_type_child.get("type") == "stop":
-                                            shift_amount = "0"
-                                        elif direction_type_child.get("type") == "down":
-                                            pass
-                                        else:
-                                            raise ImportError(
-                                                "Unrecognized octave shift details"
-                                            )
-                                        measure_strs.append(
-                                            f"\\ottava #{shift_amount} "
-                                        )
-                                    case _:
-                                        raise ImportError(
-                                            "Unrecognized direction type: "
-                                            + direction_type_child.tag
-                                        )
+                            if this_buffer:
+                                if expression_buffer is None:
+                                    expression_buffer = Expression("")
                                 expression_buffer.add(this_buffer)
-                    case "barline":
-                        bars = {
-                            "light-light": '"||"',
-                            "light-heavy": '"|."',
-                            "heavy-light": '".|"',
-                        }
-                        end_extended_rest_after = True
-                        if (
-                            measure_child.find("bar-style") is None
-                            and measure_child.find("ending") is not None
-                        ):
-                            warnings.warn(
-                                "Unimplemented alternate endings found in mm. "
-                                + measure_num
-                            )
-                        bar_style = bars[measure_child.find("bar-style").text]
-                        if measure_child.find("repeat") is not None:
-                            repeat = measure_child.find("repeat").get("direction")
-                            if repeat == "forward":
-                                bar_style = bar_style[:-1] + ':"'
-                                end_extended_rest_after = False
-                                if n_measures_current_rest > 0:
-                                    end_extended_rest = True
-                                    n_measures_extended_rest = n_measures_current_rest
-                                    n_measures_current_rest = 0
-                            elif repeat == "backward":
-                                bar_style = '":' + bar_style[1:]
-                            else:
-                                raise ImportError(
-                                    "Unrecognized repeat direction: " + repeat
-                                )
-                        measure_strs.append(f"\\bar {bar_style}")
-
-                    case "backup":
-                        # go back by duration amount in the measure_strs list
-                        backup_duration = (
-                            int(measure_child.find("duration").text) / divisions
+                case "barline":
+                    end_extended_rest_after = True
+                    if (
+                        measure_child.find("bar-style") is None
+                        and measure_child.find("ending") is not None
+                    ):
+                        warnings.warn(
+                            "Unimplemented alternate endings found in mm. "
+                            + measure_num
                         )
-                        cur_backed_up = 0
-                        n_backup = 0
-                        for s in reversed(measure_strs):
-                            n_backup -= 1
-                            if not isinstance(s, Note):
-                                continue
-                            cur_backed_up += s.duration_num
-                            if cur_backed_up == backup_duration:
-                                s.start_poly = "<< {"
-                                break
-                            elif cur_backed_up > backup_duration:
-                                raise ImportError("Backup duration could not be met")
-                        assert cur_backed_up == backup_duration
-                        measure_strs.append("} \\\\ {")
-                        remaining_backup_duration = backup_duration
-
-                        if n_measures_current_rest > 0:
-                            n_measures_current_rest = 0
-                            warnings.warn(
-                                f"Backup in measure {measure_num} during extended rest"
+                    bar_style = tables.bar_styles[measure_child.find("bar-style").text]
+                    if measure_child.find("repeat") is not None:
+                        repeat = measure_child.find("repeat").get("direction")
+                        if repeat == "forward":
+                            bar_style = bar_style[:-1] + ':"'
+                            end_extended_rest_after = False
+                            if n_measures_current_rest > 0:
+                                end_extended_rest = True
+                                n_measures_extended_rest = n_measures_current_rest
+                                n_measures_current_rest = 0
+                        elif repeat == "backward":
+                            bar_style = '":' + bar_style[1:]
+                        else:
+                            raise ImportError(
+                                "Unrecognized repeat direction: " + repeat
                             )
+                    measure_strs.append(f"\\bar {bar_style}")
 
-                    case "print":
-                        # used for line breaks and page breaks
-                        pass
-                    case _:
-                        raise ImportError(
-                            "Unrecognized measure child: " + measure_child.tag
-                        )
+                case "backup":
+                    # go back by duration amount in the measure_strs list
+                    backup_duration = Fraction(
+                        int(measure_child.find("duration").text), divisions
+                    )
+                    cur_backed_up = Fraction(0)
+                    n_backup = 0
+                    for s in reversed(measure_strs):
+                        n_backup -= 1
+                        if not isinstance(s, Note):
+                            continue
+                        cur_backed_up += s.duration_num
+                        if cur_backed_up == backup_duration:
+                            s.start_poly = "<< {"
+                            break
+                        elif cur_backed_up > backup_duration:
+                            raise ImportError("Backup duration could not be met")
+                    assert cur_backed_up == backup_duration
+                    voice_split_idx = len(measure_strs)
+                    measure_strs.append("} \\\\ {")
+                    remaining_backup_duration = backup_duration
 
-            if remaining_backup_duration > 0:
-                new_note = Note(
-                    None,
-                    time_info,
-                    in_cue=in_cue,
-                    cue=in_cue,
-                    pitch=["s"],
-                    duration_num=remaining_backup_duration,
-                )
-                ret = add_note(
-                    new_note,
-                    instrument_strs,
-                    expression_buffer,
-                    measure_strs,
-                    remaining_backup_duration,
-                )
-                expression_buffer, remaining_backup_duration, in_cue = ret
+                    if n_measures_current_rest > 0:
+                        n_measures_current_rest = 0
+                        warnings.warn(
+                            f"Backup in measure {measure_num} during extended rest"
+                        )
 
-            if first_measure:
-                if pickup_duration != measure_duration:
-                    measure_strs[pickup_idx] = (
-                        f"\\partial {note.duration_num_to_str(pickup_duration, measure_duration)}"
+                case "print":
+                    # used for line breaks and page breaks
+                    pass
+                case _:
+                    raise ImportError(
+                        "Unrecognized measure child: " + measure_child.tag
                     )
-                else:
-                    measure_strs[pickup_idx] = ""
 
-            if end_extended_rest:
-                if n_measures_extended_rest > 1:
-                    replace_with_extended_rests(
-                        instrument_strs,
-                        extended_rest_measure_duration,
-                        n_measures_extended_rest,
-                        time_info,
-                    )
-                end_extended_rest = False
-                n_measures_extended_rest = 0
+        if remaining_backup_duration > 0:
+            new_note = Note(
+                None,
+                time_info,
+                in_cue=in_cue,
+                cue=in_cue,
+                pitch=["s"],
+                duration_num=remaining_backup_duration,
+            )
+            ret = add_note(
+                new_note,
+                expression_buffer,
+                measure_strs,
+                voice_split_idx,
+                remaining_backup_duration,
+            )
+            expression_buffer, remaining_backup_duration, in_cue = ret
 
-            for s in measure_strs:
-                instrument_strs.append(" ")
-                if isinstance(s, Note) and s.same_chord(last_chord):
-                    s.pitch = ["q"]
-                elif isinstance(s, Note) and s.chord:
-                    last_chord = s
-                instrument_strs.append(s)
+        if first_measure:
+            if pickup_duration != measure_duration:
+                measure_strs[pickup_idx] = (
+                    f"\\partial {note.duration_num_to_str(pickup_duration, measure_duration)}"
+                )
+            else:
+                measure_strs[pickup_idx] = ""
 
-            if end_extended_rest_after:
-                if n_measures_current_rest > 1:
-                    replace_with_extended_rests(
-                        instrument_strs,
-                        measure_duration,
-                        n_measures_current_rest,
-                        time_info,
-                    )
-                end_extended_rest_after = False
-                n_measures_current_rest = 0
+        result = MeasureResult(
+            measure_num=measure_num,
+            measure_strs=measure_strs,
+            ends_cue=ends_cue,
+            end_extended_rest=end_extended_rest,
+            n_measures_extended_rest=n_measures_extended_rest,
+            extended_rest_measure_duration=extended_rest_measure_duration,
+            rest_positions=rest_positions,
+            end_extended_rest_after=end_extended_rest_after,
+            n_measures_rest_run=n_measures_current_rest,
+            measure_duration=measure_duration,
+        )
+        if end_extended_rest_after:
+            n_measures_current_rest = 0
 
-            instrument_strs.append("|\n")
-            first_measure = False
-        instrument_strs.append("}")
-        self.instrument_str = "".join([str(s) for s in instrument_strs])
-        self.full_name_var = self.var_name + "_name"
-        self.short_name_var = self.var_name + "_short_name"
-        self.name_str = f"""{self.full_name_var} = "{self.full_name}"\n{self.short_name_var} = "{self.full_name}"\n"""
-        self.book_str = f"\\book {{ \\bookOutputSuffix \\{self.var_name}_name  \\header {{ instrument = \\{self.var_name}_name }}  \\score {{ \\{self.var_name} }} }}\n"
-        self.book_part_str = f"\\bookpart {{ \\header {{ instrument = \\{self.var_name}_name }}  \\score {{ \\{self.var_name} }} }}\n"
+        state.divisions = divisions
+        state.measure_duration = measure_duration
+        state.time_info = time_info
+        state.rest_key = rest_key
+        state.in_cue = in_cue
+        state.expression = (
+            tuple(expression_buffer.text) if expression_buffer is not None else None
+        )
+        state.n_measures_current_rest = n_measures_current_rest
+        state.first_measure = False
+        state.pickup_idx = pickup_idx
+        state.pickup_duration = pickup_duration
+        state._key = None
+        return result
@@ -1,150 +1,919 @@
-import xml.etree.ElementTree as ET
+import xml.etree.ElementTree
 import configparser
 import os
-import tkinter as tk
-from tkinter import filedialog
-from instrument import Instrument
+import xmlbackend
+from instrument import Instrument, MeasureState, is_percussion
+from writer import LilyPondWriter
+from profiling import Profiler, null_span
 import argparse
+import glob
+import io
+import itertools
+import time
+import warnings
+from collections import deque
+from contextlib import contextmanager
+from typing import IO, TYPE_CHECKING, Iterable, TextIO
 
+if TYPE_CHECKING:
+    from cache import PartCache
 
-def parse(args, config_info):
-    filename = args.input
-    arranger = config_info['Preferences']['Arranger']
-    version = config_info['Preferences']['Version']
-    subtitle = args.subtitle
-    tree = ET.parse(filename)
-    root = tree.getroot()
+
+def iterparse_score(source, part_filter=None):
+    """
+    Stream a partwise score. Returns the root element, already holding the header elements (work, identification,
+    part-list), and an iterator over the parts. Each part is detached from the tree as soon as the next one is
+    requested, so only one part is ever held in memory. If part_filter is given, it is called with the <score-part>
+    element of each part, and the parts for which it returns False are dropped measure by measure as they are read.
+    """
+    context = xmlbackend.iterparse(source, ("start", "end"))
+    _, root = next(context)
     if root.tag != "score-partwise":
         raise ImportError("MusicXML file must be partwise")
-    part_list = root.find('part-list')
-    title = None
-    work = root.find('work')
-    if work is not None:
-        title = work.find('work-title').text
+    depth = 1
+    part = None
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            if depth == 2 and elem.tag == "part":
+                part = elem
+                break
+        else:
+            depth -= 1
+
+    def selected(part):
+        return part_filter is None or part_filter(
+            score_part(root.find("part-list"), part.get("id"))
+        )
+
+    def parts():
+        nonlocal depth, part
+        skip = part is not None and not selected(part)
+        for event, elem in context:
+            if event == "start":
+                depth += 1
+                if depth == 2 and elem.tag == "part":
+                    part = elem
+                    skip = not selected(part)
+                continue
+            depth -= 1
+            if depth == 1 and elem.tag == "part":
+                if not skip:
+                    yield elem
+                elem.clear()
+                root.remove(elem)
+            elif depth == 2 and skip:
+                del part[:]
+
+    return root, parts()
+
+
+def score_part(part_list, part_id):
+    """The <score-part> entry of the part list with the given id"""
+    for part in part_list:
+        if part.get("id") == part_id:
+            return part
+    raise ImportError(f"Part {part_id} is missing from the part list")
+
+
+def select_parts(only=None, exclude=None):
+    """
+    A part filter for iterparse_score that keeps the parts matching any of only (all parts if None) and none of
+    exclude. A part matches an id or a name, compared case-insensitively, if it is its id or its part name.
+    Returns None if all parts are kept.
+    """
+    if not only and not exclude:
+        return None
+    only = None if not only else {name.casefold() for name in only}
+    exclude = set() if not exclude else {name.casefold() for name in exclude}
+
+    def part_filter(part):
+        names = {part.get("id").casefold()}
+        part_name = part.find("part-name")
+        if part_name is not None and part_name.text is not None:
+            names.add(part_name.text.casefold())
+        return (only is None or not names.isdisjoint(only)) and names.isdisjoint(
+            exclude
+        )
+
+    return part_filter
+
+
+def convert_part(
+    part_xml, part_list_xml, debug, checkpoints=None, start_state=None, profile=False
+):
+    """
+    Build an Instrument from serialized elements, so that parts can be converted in worker processes. Returns the
+    Instrument and, if profile is true, the Profiler that recorded its conversion, to be merged into that of the
+    parent process (or else None).
+    """
+    profiler = Profiler() if profile else None
+    instrument = Instrument(
+        xmlbackend.fromstring(part_xml),
+        xmlbackend.fromstring(part_list_xml),
+        debug,
+        checkpoints,
+        start_state=start_state,
+        profiler=profiler,
+    )
+    return instrument, profiler
+
+
+def convert_parts(
+    parts,
+    part_list,
+    debug,
+    jobs=1,
+    cache=None,
+    source="",
+    measure_jobs=1,
+    start_state=None,
+    profiler=None,
+):
+    """
+    Yield an Instrument for every part, in score order. With more than one job, the parts are fanned out to a process
+    pool, with at most twice as many parts in flight as there are workers. With a PartCache, parts whose XML has been
+    converted before are loaded from it instead, and changed parts only reparse the measures that changed since the
+    last conversion of the same part of source. When the parts are converted one after another, each part without
+    cached checkpoints is split into chunks of measures that are parsed by measure_jobs worker processes. Percussion
+    parts are skipped without being converted. Each part starts from start_state, if it is given (see Instrument).
+    The cache is keyed by the parts only, so it must not be combined with a start_state. The records of parts
+    converted in worker processes are merged into the profiler.
+    """
+
+    def without_percussion(parts):
+        for instr_elem in parts:
+            if is_percussion(instr_elem):
+                warnings.warn(
+                    "Skipping percussion clef instrument "
+                    + score_part(part_list, instr_elem.get("id")).find("part-name").text
+                )
+                continue
+            yield instr_elem
+
+    parts = without_percussion(parts)
+
+    def cached(instrument, key, checkpoints_key):
+        cache.put(checkpoints_key, instrument.checkpoints)
+        instrument.checkpoints = None
+        cache.put(key, instrument)
+        return instrument
+
+    if jobs <= 1:
+        for instr_elem in parts:
+            if cache is None:
+                yield Instrument(
+                    instr_elem,
+                    part_list,
+                    debug,
+                    jobs=measure_jobs,
+                    start_state=start_state,
+                    profiler=profiler,
+                )
+                continue
+            key = cache.key(instr_elem, part_list)
+            instrument = cache.get(key)
+            if instrument is None:
+                checkpoints_key = cache.checkpoints_key(source, instr_elem.get("id"))
+                instrument = Instrument(
+                    instr_elem,
+                    part_list,
+                    debug,
+                    cache.get(checkpoints_key) or {},
+                    profiler=profiler,
+                )
+                instrument = cached(instrument, key, checkpoints_key)
+            yield instrument
+        return
+    from concurrent.futures import Future, ProcessPoolExecutor
+
+    part_list_xml = xmlbackend.tostring(part_list)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+
+        def result(key, checkpoints_key, future):
+            instrument, part_profiler = future.result()
+            if part_profiler is not None:
+                profiler.merge(part_profiler)
+            if checkpoints_key is not None:
+                instrument = cached(instrument, key, checkpoints_key)
+            return instrument
+
+        for instr_elem in parts:
+            key = None
+            checkpoints_key = None
+            checkpoints = None
+            if cache is not None:
+                key = cache.key(instr_elem, part_list)
+                instrument = cache.get(key)
+                if instrument is not None:
+                    future = Future()
+                    future.set_result((instrument, None))
+                    pending.append((None, None, future))
+                    continue
+                checkpoints_key = cache.checkpoints_key(source, instr_elem.get("id"))
+                checkpoints = cache.get(checkpoints_key) or {}
+            future = executor.submit(
+                convert_part,
+                xmlbackend.tostring(instr_elem),
+                part_list_xml,
+                debug,
+                checkpoints,
+                start_state,
+                profiler is not None,
+            )
+            pending.append((key, checkpoints_key, future))
+            if len(pending) >= 2 * jobs:
+                yield result(*pending.popleft())
+        while pending:
+            yield result(*pending.popleft())
+
+
+def fold_repeats(instruments):
+    """Yield the instruments, with the runs of identical measures in their music written as percent repeats"""
+    from repeats import percent_repeats
+
+    for instrument in instruments:
+        if not instrument.percussion:
+            instrument.instrument_str = percent_repeats(instrument.instrument_str)
+        yield instrument
+
+
+def share_music(instruments):
+    """
+    Yield the instruments, making each one whose converted music is identical to that of an earlier one refer to the
+    music variable of the earlier one instead of holding a copy of the music
+    """
+    music_vars = {}  # music digest: variable of the first part with that music
+    for instrument in instruments:
+        if not instrument.percussion:
+            music_var = music_vars.setdefault(
+                instrument.music_digest(), instrument.var_name
+            )
+            if music_var != instrument.var_name:
+                instrument.share(music_var)
+        yield instrument
+
+
+@contextmanager
+def open_output(output_file):
+    """
+    Open output_file for writing through a temporary file next to it, which replaces output_file only once the block
+    completes, so that a failed conversion leaves an existing output as it was
+    """
+    tmp_path = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", buffering=1 << 16) as out_file:
+            yield out_file
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def open_cache(args, config_info):
+    """The PartCache selected by the command line arguments, or None if caching is off"""
+    if getattr(args, "cache", None) is None:
+        return None
+    from cache import PartCache
+
+    return PartCache(args.cache, args.cache_size * 1024 * 1024, config_info)
+
+
+# or the lxml equivalents of the elements
+ScoreSource = (
+    str
+    | os.PathLike
+    | bytes
+    | IO
+    | xml.etree.ElementTree.Element
+    | xml.etree.ElementTree.ElementTree
+)
+
+default_subtitle = '\\markup {the \\italic "Subtitle"}'
+
+
+def is_mxl(source):
+    """Whether a path, bytes or file object holds a compressed MusicXML (.mxl) archive"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source).lower().endswith(".mxl")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:4]) == b"PK\x03\x04"
+    if hasattr(source, "seekable") and source.seekable():
+        start = source.tell()
+        magic = source.read(4)
+        source.seek(start)
+        return magic == b"PK\x03\x04"
+    return False
+
+
+def open_mxl(source):
+    """
+    Open the score in a compressed MusicXML archive, as a binary stream that is decompressed as it is read. The score
+    is the first root file listed in META-INF/container.xml.
+    """
+    import zipfile
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile as e:
+        raise ImportError(f"Compressed MusicXML file is not a valid zip archive: {e}")
+    with archive:
+        try:
+            container = xmlbackend.fromstring(archive.read("META-INF/container.xml"))
+        except KeyError:
+            raise ImportError("Compressed MusicXML file has no META-INF/container.xml")
+        for elem in container.iter():
+            if elem.tag.rpartition("}")[2] == "rootfile" and elem.get("full-path"):
+                return archive.open(
+                    elem.get("full-path")
+                )  # stays readable after the archive is closed
+    raise ImportError("Compressed MusicXML file has no root file")
+
+
+def open_score(source, part_filter=None):
+    """
+    Returns the root element of a score, an iterator over its parts and the path it was read from ('' if it was not
+    read from a path). The source can be a path, the bytes of a file or a file object, of either a MusicXML file or a
+    compressed .mxl archive, or an already parsed Element or ElementTree, which is left unchanged. Only the parts for
+    which part_filter (see iterparse_score) returns True are iterated over.
+    """
+    if is_mxl(source):
+        name = os.fspath(source) if isinstance(source, (str, os.PathLike)) else ""
+        stream = open_mxl(source)
+        root, parts = iterparse_score(stream, part_filter)
+
+        def closing_parts():
+            with stream:
+                yield from parts
+
+        return root, closing_parts(), name
+    if xmlbackend.is_tree(source):
+        source = source.getroot()
+    if xmlbackend.is_element(source):
+        if source.tag != "score-partwise":
+            raise ImportError("MusicXML file must be partwise")
+        part_list = source.find("part-list")
+        parts = [
+            part
+            for part in source.findall("part")
+            if part_filter is None or part_filter(score_part(part_list, part.get("id")))
+        ]
+        return source, iter(parts), ""
+    if isinstance(source, (str, os.PathLike)):
+        return *iterparse_score(source, part_filter), os.fspath(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return *iterparse_score(io.BytesIO(source), part_filter), ""
+    name = getattr(source, "name", "")
+    return *iterparse_score(source, part_filter), name if isinstance(name, str) else ""
+
+
+def open_excerpt(source, first, last, part_filter=None):
+    """
+    Like open_score, but each part only holds its measures numbered first to last, and the first of them also sets
+    the divisions, key, time and clef in effect before it. Also returns whether the excerpt starts after the first
+    measure. A MusicXML file given by path is read through its MeasureIndex, which is saved next to it, so only the
+    header and the requested measures are parsed.
+    """
+    from excerpt import MeasureIndex, excerpt_part
+
+    if isinstance(source, (str, os.PathLike)) and not is_mxl(source):
+        index = MeasureIndex.load(os.fspath(source))
+        root = index.read_header()
+        if root.tag != "score-partwise":
+            raise ImportError("MusicXML file must be partwise")
+        part_list = root.find("part-list")
+        parts = (
+            index.read_part(part_idx, first, last)
+            for part_idx, (part_id, _, _) in enumerate(index.parts)
+            if part_filter is None or part_filter(score_part(part_list, part_id))
+        )
+        return root, parts, os.fspath(source), not index.starts_at(first)
+    root, parts, filename = open_score(source, part_filter)
+    first_part = next(parts, None)
+    if first_part is None:
+        return root, parts, filename, False
+    continued = len(first_part) > 0 and first_part[0].get("number") != first
+    parts = itertools.chain([first_part], parts)
+    return (
+        root,
+        (excerpt_part(part, first, last) for part in parts),
+        filename,
+        continued,
+    )
+
+
+def write_score(
+    source: ScoreSource,
+    out: TextIO,
+    *,
+    parts: str = "together",
+    subtitle: str = default_subtitle,
+    arranger: str = "Arranger",
+    version: str = "2.24.3",
+    title: str | None = None,
+    debug: bool = False,
+    jobs: int = 1,
+    measure_jobs: int = 1,
+    cache: "PartCache | None" = None,
+    only: Iterable[str] | None = None,
+    exclude: Iterable[str] | None = None,
+    measures: tuple[str, str] | None = None,
+    profiler: Profiler | None = None,
+    share_parts: bool = True,
+    repeats: bool = False,
+) -> int:
+    """
+    Convert a score (see open_score for the accepted sources) and write the LilyPond file to the text stream out, one
+    part at a time. Returns the number of measures converted, summed over the parts. If only or exclude are given,
+    only the parts selected by them (see select_parts) are converted. If measures is given, only the measures
+    numbered measures[0] to measures[1] are converted (see open_excerpt), without the cache. A Profiler records the
+    time taken by reading the XML, by each part and measure and by writing the file. With share_parts, the music of a
+    part that converts to the same music as an earlier part is written once, in the variable of the earlier part.
+    With repeats, runs of identical measures are written once, as percent repeats (see repeats.percent_repeats).
+    """
+    if parts not in ("together", "separate"):
+        raise ValueError(f"parts must be 'together' or 'separate', not {parts!r}")
+    span = null_span if profiler is None else profiler.span
+    start_state = None
+    with span("xml_parse"):
+        if measures is None:
+            root, part_elements, filename = open_score(
+                source, select_parts(only, exclude)
+            )
+        else:
+            root, part_elements, filename, continued = open_excerpt(
+                source, *measures, select_parts(only, exclude)
+            )
+            if continued:
+                start_state = MeasureState.continued()
+            cache = None
+    part_list = root.find("part-list")
+    if title is None:
+        work = root.find("work")
+        if work is not None:
+            title = work.find("work-title").text
     if title is None:
-        title = os.path.splitext(os.path.basename(filename))[0]
-    composer = root.find('identification').find('creator')
+        title = (
+            os.path.splitext(os.path.basename(filename))[0] if filename else "Untitled"
+        )
+    composer = root.find("identification").find("creator")
     if composer is None:
-        composer = 'Composer Unknown'
+        composer = "Composer Unknown"
     else:
         composer = composer.text
-    file_str = f'\\version "{version}"\n\\language "english"\n#(set-default-paper-size "letter")\n%\\pointAndClickOff\n\n'
-    file_str += f"""\\header {{
-      title = "{title}"
-      subtitle = {subtitle}
-      composer = "{composer}"
-      arranger = "arr. {arranger}"
-      tagline = #f
-    }}
-    ub = \\upbow
-    db = \\downbow
-    """
-    instruments = [Instrument(instr_elem, part_list, args.debug) for instr_elem in root if instr_elem.tag == 'part']
-    instruments = [i for i in instruments if not i.percussion]
-
-    file_str += '\n\n\n'.join([i.instrument_str for i in instruments])
-    file_str += '\n\n'
-    file_str += ''.join([i.name_str for i in instruments])
-    if args.parts == 'together':
-        file_str += '\n% Separate Files for Each Instrument\n%{\n'
-    else:
-        file_str += '\n% Separate Files for Each Instrument\n%%{\n'
-    file_str += ''.join([i.book_str for i in instruments])
+    writer = LilyPondWriter(out, parts)
+    with span("file_write"):
+        writer.write_header(title, subtitle, composer, arranger, version)
+    instruments = convert_parts(
+        (
+            part_elements
+            if profiler is None
+            else profiler.iterate(part_elements, "xml_parse")
+        ),
+        part_list,
+        debug,
+        jobs,
+        cache,
+        os.path.abspath(filename) if filename else "",
+        measure_jobs,
+        start_state,
+        profiler,
+    )
+    if repeats:
+        instruments = fold_repeats(instruments)
+    if share_parts:
+        instruments = share_music(instruments)
+    if profiler is not None:
+        instruments = profiler.iterate(
+            instruments,
+            "part",
+            "part",
+            lambda instrument: {
+                "id": instrument.id,
+                "name": instrument.full_name,
+                "measures": instrument.n_measures,
+            },
+        )
+    n_measures = 0
+    for instrument in instruments:
+        with span("file_write"):
+            writer.write_instrument(instrument)
+        n_measures += instrument.n_measures
+    with span("file_write"):
+        writer.write_footer()
+    if debug and cache is not None:
+        print(
+            f"Part cache: {cache.hits} hits, {cache.misses} misses, {cache.size} bytes"
+        )
+    return n_measures
+
+
+def convert(
+    source: ScoreSource,
+    out: TextIO | None = None,
+    *,
+    parts: str = "together",
+    subtitle: str = default_subtitle,
+    arranger: str = "Arranger",
+    version: str = "2.24.3",
+    title: str | None = None,
+    debug: bool = False,
+    jobs: int = 1,
+    measure_jobs: int = 1,
+    cache: "PartCache | None" = None,
+    only: Iterable[str] | None = None,
+    exclude: Iterable[str] | None = None,
+    measures: tuple[str, str] | None = None,
+    profiler: Profiler | None = None,
+    share_parts: bool = True,
+    repeats: bool = False,
+) -> str | None:
+    """
+    Convert a MusicXML score to LilyPond, without going through the command line. The source can be a path, the bytes
+    of a file or a file object (of a .musicxml/.xml file or a compressed .mxl archive), or an already parsed Element or
+    ElementTree. The LilyPond file is returned as a string, or written to the text stream out if one is given (then
+    None is returned). The keyword arguments match the command line options and preferences; the title defaults to
+    the work title of the score, or the file name. only and exclude are lists of part ids or names, measures is the
+    pair of the first and last measure numbers to convert, profiler is a profiling.Profiler to record timings in,
+    share_parts=False writes the music of every part in full, even when parts are identical, and repeats=True writes
+    runs of identical measures as percent repeats.
+    """
+    options = dict(
+        parts=parts,
+        subtitle=subtitle,
+        arranger=arranger,
+        version=version,
+        title=title,
+        debug=debug,
+        jobs=jobs,
+        measure_jobs=measure_jobs,
+        cache=cache,
+        only=only,
+        exclude=exclude,
+        measures=measures,
+        profiler=profiler,
+        share_parts=share_parts,
+        repeats=repeats,
+    )
+    if out is not None:
+        write_score(source, out, **options)
+        return None
+    out = io.StringIO()
+    write_score(source, out, **options)
+    return out.getvalue()
+
+
+def write(args, config_info, out, jobs=1, cache=None, measure_jobs=1, profiler=None):
+    """
+    Convert the score args.input and write the LilyPond file to the text stream out, one part at a time. Returns the
+    number of measures converted, summed over the parts.
+    """
+    return write_score(
+        args.input,
+        out,
+        parts=args.parts,
+        subtitle=args.subtitle,
+        arranger=config_info["Preferences"]["Arranger"],
+        version=config_info["Preferences"]["Version"],
+        debug=args.debug,
+        jobs=jobs,
+        measure_jobs=measure_jobs,
+        cache=cache,
+        only=getattr(args, "only", None),
+        exclude=getattr(args, "exclude", None),
+        measures=getattr(args, "measures", None),
+        profiler=profiler,
+        share_parts=getattr(args, "share_parts", True),
+        repeats=getattr(args, "repeats", False),
+    )
+
 
-    if args.parts == 'together':
-        file_str += '%}\n\n% One File for All Instruments\n%%{'
+def parse(args, config_info, jobs=1, measure_jobs=1):
+    out = io.StringIO()
+    write(args, config_info, out, jobs, measure_jobs=measure_jobs)
+    return out.getvalue()
+
+
+input_extensions = (".musicxml", ".xml", ".mxl")
+
+
+def find_batch_inputs(paths):
+    """Expand directories (recursively) and glob patterns into a sorted list of MusicXML files"""
+    inputs = set()
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(
+                os.path.join(glob.escape(path), "**", "*"), recursive=True
+            )
+        else:
+            matches = glob.glob(path, recursive=True)
+        inputs.update(
+            m
+            for m in matches
+            if os.path.isfile(m) and m.lower().endswith(input_extensions)
+        )
+    return sorted(inputs)
+
+
+def convert_file(args, config_info, output_file):
+    """Convert args.input to output_file, returning the number of measures converted"""
+    with open_output(output_file) as out_file:
+        return write(args, config_info, out_file, cache=open_cache(args, config_info))
+
+
+def convert_batch(args, config_info, paths, output_dir=None, jobs=1):
+    """
+    Convert every MusicXML file found in paths, skipping files whose output is newer than the input. The files are
+    converted by a pool of jobs worker processes that is reused for the whole batch. Prints a throughput summary.
+    With an output_dir, the outputs are laid out in it as the inputs are in the deepest directory holding them all.
+    Raises ValueError if two inputs would be written to the same output, like song.xml and song.musicxml.
+    """
+    start = time.perf_counter()
+    input_files = find_batch_inputs(paths)
+    if output_dir is not None and input_files:
+        input_root = os.path.commonpath(
+            [os.path.dirname(os.path.abspath(input_file)) for input_file in input_files]
+        )
+    output_files = {}  # absolute output path: (input, output)
+    for input_file in input_files:
+        if output_dir is not None:
+            relative_path = os.path.relpath(os.path.abspath(input_file), input_root)
+            output_file = os.path.join(
+                output_dir, os.path.splitext(relative_path)[0] + ".ly"
+            )
+        else:
+            output_file = os.path.splitext(input_file)[0] + ".ly"
+        other_input, _ = output_files.setdefault(
+            os.path.abspath(output_file), (input_file, output_file)
+        )
+        if not os.path.samefile(other_input, input_file):
+            raise ValueError(
+                f"{other_input} and {input_file} would both be converted to {output_file}"
+            )
+    tasks = []
+    n_skipped = 0
+    for input_file, output_file in output_files.values():
+        if os.path.isfile(output_file) and os.path.getmtime(
+            output_file
+        ) > os.path.getmtime(input_file):
+            n_skipped += 1
+            continue
+        file_args = argparse.Namespace(**vars(args))
+        file_args.input = input_file
+        tasks.append((file_args, output_file))
+        if output_dir is not None:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    n_files = 0
+    n_measures = 0
+    n_failed = 0
+
+    def record(input_file, get_result):
+        nonlocal n_files, n_measures, n_failed
+        try:
+            n_measures += get_result()
+            n_files += 1
+            if args.debug:
+                print(f"Converted {input_file}")
+        except Exception as e:
+            n_failed += 1
+            print(f"Failed to convert {input_file}: {e}")
+
+    if jobs <= 1:
+        for file_args, output_file in tasks:
+            record(
+                file_args.input,
+                lambda: convert_file(file_args, config_info, output_file),
+            )
     else:
-        file_str += '%}\n\n% One File for All Instruments\n%{'
-    file_str += """
-\\book {
-  \\bookOutputSuffix "Parts"
-  \\paper {
-    print-page-number = ##f
-  }
-  """
-    file_str += ''.join([i.book_part_str for i in instruments])
-    file_str += "}\n%}\n"
-    file_str += """
-% Full Score
-%%{
-\\book {
-  \\paper {
-    #(layout-set-staff-size 17)
-    left-margin = 0.5\\cm
-    indent = 1.5\\cm
-    short-indent = 1.0\\cm  
-  }
-
-  \\bookOutputSuffix "Full Score"
-  \\header { instrument = "Full Score" }
-  \\score {
-    <<
-"""
-    file_str += '\n'.join([f'      \\new Staff \\with {{ instrumentName = \\{i.full_name_var} shortInstrumentName = '
-                           f'\\{i.short_name_var} }} \\{i.var_name}' for i in instruments])
-    file_str += """
-    >>
-  }
-}
-%}
-"""
-    return file_str
-
-
-if __name__ == '__main__':
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                (
+                    file_args.input,
+                    executor.submit(convert_file, file_args, config_info, output_file),
+                )
+                for file_args, output_file in tasks
+            ]
+            for input_file, future in futures:
+                record(input_file, future.result)
+
+    elapsed = time.perf_counter() - start
+    rate = 1 / elapsed if elapsed > 0 else 0
+    print(
+        f"Converted {n_files} files ({n_measures} measures) in {elapsed:.2f} s: {n_files * rate:.1f} files/s, "
+        f"{n_measures * rate:.0f} measures/s; {n_skipped} up to date, {n_failed} failed"
+    )
+    return n_files, n_measures, n_skipped, n_failed
+
+
+def gui_filedialog():
+    """
+    The Tk file dialog module, with the Tk root window hidden. Tk is only imported here, when a file has to be chosen
+    interactively, so that converting with -i and -o starts quickly and works on hosts without Tk.
+    """
+    try:
+        import tkinter as tk
+        from tkinter import filedialog
+    except ImportError as e:
+        raise ImportError(
+            f"Tk is not installed ({e}), give the input and output files with -i and -o"
+        ) from e
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        raise ImportError(
+            f"Tk cannot open a window ({e}), give the input and output files with -i and -o"
+        ) from e
+    root.withdraw()
+    return filedialog
+
+
+if __name__ == "__main__":
     config = configparser.ConfigParser()
     config.read(os.path.join(".", "preferences.ini"))
 
-    parser = argparse.ArgumentParser(description='Convert MusicXML to LilyPond')
-    parser.add_argument('-i', '--input', help='Input file (*.musicxml;*.xml)')
-    parser.add_argument('-o', '--output', help='Output file (*.ly)')
-    parser.add_argument('-p', '--parts', help='Output parts separately or together')
-    parser.add_argument('-d', '--debug', help='Debug mode')
-    parser.add_argument('-s', '--subtitle', help='Subtitle in Lilypond markup (including \\markup)')
+    parser = argparse.ArgumentParser(description="Convert MusicXML to LilyPond")
+    parser.add_argument("-i", "--input", help="Input file (*.musicxml;*.xml;*.mxl)")
+    parser.add_argument("-o", "--output", help="Output file (*.ly)")
+    parser.add_argument("-p", "--parts", help="Output parts separately or together")
+    parser.add_argument("-d", "--debug", help="Debug mode")
+    parser.add_argument(
+        "-s", "--subtitle", help="Subtitle in Lilypond markup (including \\markup)"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of parts (or files, in batch mode) to convert in parallel",
+    )
+    parser.add_argument(
+        "-m",
+        "--measure-jobs",
+        help="Number of processes converting chunks of measures of each part",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        help="Directory of a cache of converted parts, reused across runs",
+    )
+    parser.add_argument("--cache-size", help="Maximum size of the part cache in MB")
+    parser.add_argument(
+        "--only", nargs="+", help="Ids or names of the only parts to convert"
+    )
+    parser.add_argument(
+        "--exclude", nargs="+", help="Ids or names of parts not to convert"
+    )
+    parser.add_argument(
+        "--measures", help="Range of measure numbers to convert, like 120-180"
+    )
+    parser.add_argument(
+        "--profile",
+        help="File to write the time taken by each stage (including building the notes), part and measure to",
+    )
+    parser.add_argument(
+        "--profile-format",
+        help="Format of the profile: json (a summary) or chrome (a trace)",
+    )
+    parser.add_argument(
+        "--share-parts",
+        help="Write the music of identical parts once, in a variable they share",
+    )
+    parser.add_argument(
+        "--repeats", help="Write runs of identical measures as percent repeats"
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        nargs="+",
+        help="Directories or glob patterns of files to convert in batch",
+    )
     args = parser.parse_args()
 
-    if args.input is None or not os.path.isfile(args.input) or (not args.input.endswith('.musicxml') and not args.input.endswith('.xml')):
-        args.input = None
-
-    if args.output is None or not args.output.endswith('.ly'):
-        args.output = None
-
     if args.parts is None:
-        args.parts = 'together'
+        args.parts = "together"
     args.parts = args.parts.lower()
-    if args.parts in ['separate', 's']:
-        args.parts = 'separate'
+    if args.parts in ["separate", "s"]:
+        args.parts = "separate"
     else:
-        args.parts = 'together'
+        args.parts = "together"
 
     if args.subtitle is None:
-        args.subtitle = "\\markup {the \\italic \"Subtitle\"}"
+        args.subtitle = default_subtitle
 
     if isinstance(args.debug, str):
         args.debug = args.debug.lower()
-    if args.debug in ['true', 't', 'yes', 'y', '1']:
+    if args.debug in ["true", "t", "yes", "y", "1"]:
         args.debug = True
     else:
         args.debug = False
 
+    if args.jobs is None or not args.jobs.isdecimal() or int(args.jobs) < 1:
+        args.jobs = 1
+    else:
+        args.jobs = int(args.jobs)
+
+    if (
+        args.measure_jobs is None
+        or not args.measure_jobs.isdecimal()
+        or int(args.measure_jobs) < 1
+    ):
+        args.measure_jobs = 1
+    else:
+        args.measure_jobs = int(args.measure_jobs)
+
+    if args.cache_size is None or not args.cache_size.isdecimal():
+        args.cache_size = 256
+    else:
+        args.cache_size = int(args.cache_size)
+
+    if args.measures is not None:
+        first, dash, last = args.measures.partition("-")
+        if first == "" or (dash and last == ""):
+            parser.error(
+                f"argument --measures: expected a range like 120-180, not {args.measures!r}"
+            )
+        args.measures = (first, last or first)
+
+    if isinstance(args.share_parts, str):
+        args.share_parts = args.share_parts.lower()
+    args.share_parts = args.share_parts in [None, "true", "t", "yes", "y", "1"]
+
+    if isinstance(args.repeats, str):
+        args.repeats = args.repeats.lower()
+    args.repeats = args.repeats in ["true", "t", "yes", "y", "1"]
+
+    if args.profile_format is None or args.profile_format.lower() not in [
+        "json",
+        "chrome",
+    ]:
+        args.profile_format = "json"
+    else:
+        args.profile_format = args.profile_format.lower()
+
+    if args.batch is not None:
+        # in batch mode the output is a directory, and the files are written next to their inputs by default
+        try:
+            convert_batch(args, config, args.batch, args.output, jobs=args.jobs)
+        except ValueError as e:
+            parser.error(str(e))
+        raise SystemExit
+
+    if (
+        args.input is None
+        or not os.path.isfile(args.input)
+        or not args.input.endswith(input_extensions)
+    ):
+        args.input = None
+
+    if args.output is None or not args.output.endswith(".ly"):
+        args.output = None
+
+    if args.input is None or args.output is None:
+        try:
+            filedialog = gui_filedialog()
+        except ImportError as e:
+            print(e)
+            raise SystemExit(1)
+
     if args.input is None:
-        root = tk.Tk()
-        root.withdraw()
-        args.input = filedialog.askopenfilename(initialdir=config['Preferences']['DefaultInputDir'],
-                                                filetypes=[("MusicXML Files", "*.musicxml;*.xml"), ("All files", "*.*")])
-        
+        args.input = filedialog.askopenfilename(
+            initialdir=config["Preferences"]["DefaultInputDir"],
+            filetypes=[
+                ("MusicXML Files", "*.musicxml;*.xml;*.mxl"),
+                ("All files", "*.*"),
+            ],
+        )
+
     if args.input == "":
         print("Please select a file.")
     else:
-        file_str = parse(args, config)
-
         if args.output is not None:
             output_file = args.output
         else:
             file_basename = os.path.splitext(os.path.basename(args.input))[0]
-            output_file = filedialog.asksaveasfilename(initialdir=config['Preferences']['DefaultOutputDir'],
-                                                       filetypes=[("LilyPond Files", "*.ly")],
-                                                       initialfile=file_basename,
-                                                       defaultextension=".ly")
-        with open(output_file, "w") as out_file:
-            out_file.write(file_str)
+            output_file = filedialog.asksaveasfilename(
+                initialdir=config["Preferences"]["DefaultOutputDir"],
+                filetypes=[("LilyPond Files", "*.ly")],
+                initialfile=file_basename,
+                defaultextension=".ly",
+            )
+        profiler = Profiler() if args.profile is not None else None
+        with open_output(output_file) as out_file:
+            write(
+                args,
+                config,
+                out_file,
+                jobs=args.jobs,
+                cache=open_cache(args, config),
+                measure_jobs=args.measure_jobs,
+                profiler=profiler,
+            )
+        if profiler is not None:
+            profiler.write(args.profile, args.profile_format)
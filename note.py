@@ -1,35 +1,81 @@
+import sys
 import warnings
+from fractions import Fraction
+from functools import lru_cache
 
 from expression import Expression
+from tables import alter_suffixes, octave_suffix, pitch_names
 
+max_denominator = 1024
+# LilyPond strings for plain and dotted power-of-two durations, keyed by their exact length in whole notes
+duration_strs = {
+    Fraction(1, 2**exponent): str(2**exponent)
+    for exponent in range(max_denominator.bit_length())
+} | {
+    Fraction(3, 2 ** (exponent + 1)): f"{2**exponent}."
+    for exponent in range(max_denominator.bit_length())
+}
 
+
+# the same few (duration, measure duration) pairs come up for every measure, so the results are memoized
+@lru_cache(maxsize=4096)
 def duration_num_to_str(duration_num, measure_duration):
-    max_denominator = 1024
     if duration_num <= measure_duration:
-        if 1 / duration_num == int(1 / duration_num):
-            return str(int(1 / duration_num))
-        elif 1.5 / duration_num == int(1.5 / duration_num):
-            return f"{int(1.5 / duration_num)}."
-        else:
-            denominator = 1
-            while (
-                abs(duration_num - int(duration_num))
-                > denominator / (max_denominator * 2)
-                and denominator < max_denominator
-            ):
-                duration_num *= 2
-                denominator *= 2
-            return f"{denominator}*{int(duration_num)}"
+        duration_str = duration_strs.get(duration_num)
+        if duration_str is not None:
+            return duration_str
+        if duration_num.numerator == 1:
+            return str(duration_num.denominator)
+        dotted = Fraction(3, 2) / duration_num
+        if dotted.denominator == 1:
+            return f"{dotted.numerator}."
+        denominator = duration_num.denominator
+        if denominator & (denominator - 1) == 0 and denominator <= max_denominator:
+            return f"{denominator}*{duration_num.numerator}"
+        return f"1*{duration_num.numerator}/{denominator}"
     else:
         measure_str = duration_num_to_str(measure_duration, measure_duration)
-        if duration_num / measure_duration == int(duration_num / measure_duration):
-            return f"{measure_str}*{int(duration_num / measure_duration)}"
+        n_measures = duration_num / measure_duration
+        if n_measures.denominator == 1:
+            return f"{measure_str}*{n_measures.numerator}"
         else:
             return duration_num_to_str(duration_num, duration_num)
 
 
+@lru_cache(maxsize=64)
+def measure_rest_key(measure_duration):
+    """The key (see Note.key) of a plain full-measure rest, for detecting rests without building a Note for each"""
+    return Note(
+        None, (None, measure_duration), pitch=["R"], duration_num=measure_duration
+    ).key()
+
+
 class Note:
-    alter_dict = {None: "", "1": "s", "-1": "f"}
+    __slots__ = (
+        "pitch",
+        "duration",
+        "duration_num",
+        "dot",
+        "grace",
+        "start_tuplet",
+        "end_tuplet",
+        "articulations",
+        "slur",
+        "tie",
+        "chord",
+        "expression",
+        "start_poly",
+        "end_poly",
+        "trill",
+        "next_expression_buffer",
+        "in_cue",
+        "cue",
+        "start_cue",
+        "end_cue",
+        "should_end_cue",
+        "glissando",
+    )
+    alter_dict = alter_suffixes
     duration_dict = {
         "whole": "1",
         "half": "2",
@@ -58,7 +104,7 @@ class Note:
     ):
         self.pitch = [""]
         self.duration = ""
-        self.duration_num = 0  # as a float, proportion of a whole note
+        self.duration_num = Fraction(0)  # exact proportion of a whole note
         self.dot = ""
         self.grace = ""
         self.start_tuplet = ""
@@ -67,11 +113,11 @@ class Note:
         self.slur = ""
         self.tie = ""
         self.chord = False
-        self.expression = Expression("")
+        self.expression = None  # Expression, allocated only for notes that carry one
         self.start_poly = ""
         self.end_poly = ""
         self.trill = ""
-        self.next_expression_buffer = Expression("")
+        self.next_expression_buffer = None
         self.in_cue = in_cue
         self.cue = False
         self.start_cue = ""
@@ -80,7 +126,7 @@ class Note:
         self.glissando = ""
 
         divisions, measure_duration = time_info
-        written_duration = 0
+        written_duration = Fraction(0)
         num = 0
         den = 0
 
@@ -90,101 +136,127 @@ class Note:
             self.duration = duration_num_to_str(self.duration_num, measure_duration)
             return
 
+        # one pass over the children, most frequent first. Whether a rest fills the measure depends on its type and
+        # duration, which come after it, so that is decided after the pass, and so is the duration given by the type
+        rest_element = None
+        type_text = None
+        duration_text = None
+        factor_num = factor_den = 1  # of the written duration, from dots and tuplets
         for note_child in note_element:
             match note_child.tag:
-                case "chord":
-                    self.chord = True
                 case "pitch":
-                    pitch = note_child.find("step").text.lower()
-                    alter = note_child.find("alter")
-                    if alter is not None:
-                        alter = alter.text
-                    alter = self.alter_dict[alter]
-                    ly_octave = ""
-                    octave = int(note_child.find("octave").text) - 3
-                    if octave < 0:
-                        ly_octave = "," * (0 - octave)
-                    elif octave > 0:
-                        ly_octave = "'" * octave
-                    self.pitch = [pitch + alter + ly_octave]
-
-                case "rest":
-                    is_mismatched = False
-                    if (
-                        note_element.find("type") is not None
-                        and note_element.find("duration") is not None
-                    ):
-                        is_mismatched = (
-                            note_element.find("type").text == "whole"
-                            and int(note_element.find("duration").text) / divisions
-                            == measure_duration
-                        )
-                    if note_child.get("measure") == "yes" or is_mismatched:
-                        self.pitch = ["R"]
-                        self.duration = duration_num_to_str(
-                            measure_duration, measure_duration
+                    step = note_child.findtext("step")
+                    alter = note_child.findtext("alter")
+                    octave = note_child.findtext("octave")
+                    pitch = pitch_names.get((step, alter, octave))
+                    if pitch is None:
+                        pitch = sys.intern(
+                            step.lower()
+                            + self.alter_dict[alter]
+                            + octave_suffix(int(octave))
                         )
-                        written_duration = measure_duration
-                    else:
-                        self.pitch = ["r"]
+                    self.pitch = [pitch]
                 case "duration":
-                    self.duration_num = int(note_child.text)
-                    self.duration_num = self.duration_num / divisions
+                    duration_text = note_child.text
+                    self.duration_num = Fraction(int(duration_text), divisions)
+                case "voice" | "stem" | "beam" | "tie":
+                    pass  # ties are handled in the notations section
+                case "type":
+                    type_text = note_child.text
+                case "notations":
+                    self.parse_notation(note_child, num, den)
+                case "rest":
+                    rest_element = note_child
+                    self.pitch = ["r"]
+                case "chord":
+                    self.chord = True
                 case "dot":
                     self.dot = "."
-                    written_duration *= 1.5
-                case "grace":
-                    if note_child.get("slash") != "yes":
-                        warnings.warn("Unslashed grace note in measure " + measure_num)
-                    self.grace = "\\acciaccatura "
+                    factor_num *= 3
+                    factor_den *= 2
                 case "accidental":
                     if note_child.get("parentheses") == "yes":
                         self.pitch[0] += "?"
                 case "time-modification":
-                    num = int(note_child.find("actual-notes").text)
-                    den = int(note_child.find("normal-notes").text)
-                    written_duration *= den / num
-                case "tie":
-                    # handled in the notations section
-                    pass
-                case "voice":
-                    pass
-                case "type":
-                    if self.pitch != ["R"]:
-                        self.duration = self.duration_dict[note_child.text]
-                        written_duration = 1 / int(self.duration)
-                case "stem":
-                    pass
-                case "beam":
-                    pass
-                case "notations":
-                    self.parse_notation(note_child, num, den)
+                    num = int(note_child.findtext("actual-notes"))
+                    den = int(note_child.findtext("normal-notes"))
+                    factor_num *= den
+                    factor_den *= num
+                case "grace":
+                    if note_child.get("slash") != "yes":
+                        warnings.warn("Unslashed grace note in measure " + measure_num)
+                    self.grace = "\\acciaccatura "
                 case "notehead":
                     match note_child.text:
                         case "diamond":
                             self.pitch += ["\\harmonic"]
                         case "none":
                             self.pitch = ["s"]
-                case "lyric":
-                    pass  # TODO: add lyrics parsing
-                case "instrument" | "staff":
-                    pass  # TODO: make sure this isn't important
                 case "cue":
                     self.cue = True
                     if not self.in_cue:
                         self.in_cue = True
                         self.start_cue = "\\new CueVoice { "
+                case "lyric":
+                    pass  # TODO: add lyrics parsing
+                case "instrument" | "staff":
+                    pass  # TODO: make sure this isn't important
                 case _:
                     raise ImportError(
                         f'Unrecognized note child: "{note_child.tag}" in mm. {measure_num}'
                     )
+        if rest_element is not None and (
+            rest_element.get("measure") == "yes"
+            or (
+                type_text == "whole"
+                and duration_text is not None
+                and Fraction(int(duration_text), divisions) == measure_duration
+            )
+        ):
+            # a full-measure rest, written with the length of the measure whatever its type
+            if self.pitch[0] == "r":
+                self.pitch[0] = "R"
+            self.duration = duration_num_to_str(measure_duration, measure_duration)
+            written_duration = measure_duration
+        elif type_text is not None:
+            # the type of a full-measure rest is ignored, it may be longer than any in duration_dict (a breve)
+            self.duration = self.duration_dict[type_text]
+            written_duration = Fraction(1, int(self.duration))
+        if factor_num != factor_den:
+            written_duration *= Fraction(factor_num, factor_den)
         if note_element.get("print-object") == "no":
             self.pitch = ["s"]
         if not self.cue and self.in_cue:
             self.in_cue = False
             self.should_end_cue = True
         if not self.grace:
-            assert abs(written_duration - self.duration_num) < (1 / divisions)
+            assert abs(written_duration - self.duration_num) < Fraction(1, divisions)
+
+    def copy(self):
+        copied = Note.__new__(Note)
+        copied.pitch = list(self.pitch)
+        copied.duration = self.duration
+        copied.duration_num = self.duration_num
+        copied.dot = self.dot
+        copied.grace = self.grace
+        copied.start_tuplet = self.start_tuplet
+        copied.end_tuplet = self.end_tuplet
+        copied.articulations = self.articulations
+        copied.slur = self.slur
+        copied.tie = self.tie
+        copied.chord = self.chord
+        copied.expression = self.expression
+        copied.start_poly = self.start_poly
+        copied.end_poly = self.end_poly
+        copied.trill = self.trill
+        copied.next_expression_buffer = self.next_expression_buffer
+        copied.in_cue = self.in_cue
+        copied.cue = self.cue
+        copied.start_cue = self.start_cue
+        copied.end_cue = self.end_cue
+        copied.should_end_cue = self.should_end_cue
+        copied.glissando = self.glissando
+        return copied
 
     def add_chord(self, chord):
         self.pitch.extend(chord.pitch)
@@ -217,7 +289,7 @@ class Note:
             + self.duration
             + self.dot
             + self.articulations
-            + str(self.expression)
+            + (str(self.expression) if self.expression is not None else "")
             + self.trill
             + self.glissando
             + self.slur
@@ -242,11 +314,20 @@ class Note:
                         articulation_type = articulation.tag
                         if articulation_type == "fingering":
                             if articulation.text.isdecimal():
-                                self.articulations += "-" + articulation.text
+                                self.articulations = sys.intern(
+                                    self.articulations + "-" + articulation.text
+                                )
                             else:
-                                self.articulations += f'\\finger "{articulation.text}"'
+                                self.articulations = sys.intern(
+                                    self.articulations
+                                    + f'\\finger "{articulation.text}"'
+                                )
                         elif articulation_type in self.art_dict:
-                            self.articulations += "-" + self.art_dict[articulation_type]
+                            self.articulations = sys.intern(
+                                self.articulations
+                                + "-"
+                                + self.art_dict[articulation_type]
+                            )
                         else:
                             raise ImportError(
                                 "Unrecognized articulation type: " + articulation_type
@@ -267,6 +348,8 @@ class Note:
                                     else:
                                         raise ImportError("Wavy line without trill")
                                 elif ornament.get("type") == "stop":
+                                    if self.next_expression_buffer is None:
+                                        self.next_expression_buffer = Expression("")
                                     self.next_expression_buffer.add("\\stopTrillSpan")
                                 elif ornament.get("type") == "continue":
                                     warnings.warn("Wavy line continue not implemented")
@@ -289,21 +372,29 @@ class Note:
                         "Unrecognized notation child: " + notation_child.tag
                     )
 
+    def key(self):
+        """The fields that make two notes equal, as a tuple"""
+        return (
+            tuple(self.pitch),
+            self.duration,
+            self.dot,
+            self.grace,
+            self.start_tuplet,
+            self.end_tuplet,
+            self.articulations,
+            self.slur,
+            self.tie,
+            self.chord,
+            self.trill,
+            self.cue,
+            self.glissando,
+        )
+
+    def is_measure_rest(self, rest_key):
+        """Whether this is a plain full-measure rest, given the measure_rest_key of the current time signature"""
+        return self.pitch[0] == "R" and self.key() == rest_key
+
     def __eq__(self, other):
         if not isinstance(other, Note):
             return False
-        return (
-            self.pitch == other.pitch
-            and self.duration == other.duration
-            and self.dot == other.dot
-            and self.grace == other.grace
-            and self.start_tuplet == other.start_tuplet
-            and self.end_tuplet == other.end_tuplet
-            and self.articulations == other.articulations
-            and self.slur == other.slur
-            and self.tie == other.tie
-            and self.chord == other.chord
-            and self.trill == other.trill
-            and self.cue == other.cue
-            and self.glissando == other.glissando
-        )
+        return self.key() == other.key()
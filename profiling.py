@@ -0,0 +1,124 @@
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+
+def null_span(name, category="stage", **args):
+    """Stands in for Profiler.span when profiling is off"""
+    return nullcontext()
+
+
+class Profiler:
+    """
+    Records spans of wall time, per stage, part and measure, and counters while a score is converted. The record can
+    be written as a JSON summary, or as a Chrome trace (for chrome://tracing or Perfetto) showing how the spans nest.
+    The records of worker processes can be merged into it (see merge).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []  # (name, category, start, duration, args)
+        self.worker_events = []  # (pid, events) of the profilers merged into this one
+        self.counts = {}
+
+    @contextmanager
+    def span(self, name, category="stage", **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append(
+                (name, category, start, time.perf_counter() - start, args)
+            )
+
+    def iterate(self, iterable, name, category="stage", args_of=None):
+        """Yield the items of iterable, recording a span for the time taken to produce each of them"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            args = args_of(item) if args_of is not None and item is not None else {}
+            self.events.append(
+                (name, category, start, time.perf_counter() - start, args)
+            )
+            yield item
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, other):
+        """Add the spans and counts of the Profiler of a worker process, whose times are on the same clock"""
+        self.worker_events.append((other.pid, other.events))
+        self.worker_events.extend(other.worker_events)
+        for name, n in other.counts.items():
+            self.count(name, n)
+
+    def all_events(self):
+        """The (pid, events) of this profiler and of those merged into it"""
+        return [(self.pid, self.events)] + self.worker_events
+
+    def summary(self, n_slowest=20):
+        """The total time and number of calls of each stage, the time of each part and the slowest measures"""
+        stages = {}
+        parts = []
+        measures = []
+        for name, category, _, duration, args in (
+            event for _, events in self.all_events() for event in events
+        ):
+            if category == "part":
+                parts.append(dict(args, seconds=duration))
+            elif category == "measure":
+                measures.append(dict(args, seconds=duration))
+            else:
+                stage = stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+                stage["calls"] += 1
+                stage["seconds"] += duration
+        measures.sort(key=lambda measure: -measure["seconds"])
+        return {
+            "seconds": time.perf_counter() - self.start,
+            "stages": stages,
+            "counts": self.counts,
+            "parts": parts,
+            "measures": {
+                "count": len(measures),
+                "seconds": sum(measure["seconds"] for measure in measures),
+                "slowest": measures[:n_slowest],
+            },
+        }
+
+    def chrome_trace(self):
+        """The spans as complete ("X") events of the Chrome trace event format, in microseconds"""
+        events = [
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self.start) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": 0,
+                "args": args,
+            }
+            for pid, process_events in self.all_events()
+            for name, category, start, duration, args in process_events
+        ]
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": self.counts,
+        }
+
+    def write(self, path, trace_format="json"):
+        """Write the summary (trace_format "json") or the Chrome trace (trace_format "chrome") to path"""
+        import json
+
+        with open(path, "w") as profile_file:
+            json.dump(
+                self.chrome_trace() if trace_format == "chrome" else self.summary(),
+                profile_file,
+                indent=1,
+            )
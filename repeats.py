@@ -0,0 +1,75 @@
+import re
+
+# the longest group of measures that is repeated as a whole, LilyPond draws percent signs for groups of one or two
+max_group_measures = 2
+
+# commands that must not be repeated silently (changes of key, time, clef...), spanners that may end in another
+# measure, ties into the next measure, full-measure rests (already compressed) and repeated chords (q refers to the
+# chord before it, which differs between the repetitions)
+unsafe_pattern = re.compile(
+    r"\\(?:time|key|clef|partial|bar|ottava|tempo|glissando|cresc|[<>!]|startTrillSpan|stopTrillSpan)"
+    r"|~|(?<![A-Za-z\\])[Rq]\d"
+)
+
+
+def is_repeatable(line):
+    """Whether a line of converted music is a whole measure that can be written inside a percent repeat"""
+    return (
+        line.endswith("|")
+        and not line.startswith("%")
+        and unsafe_pattern.search(line) is None
+        and line.count("{") == line.count("}")
+        and line.count("<<") == line.count(">>")
+        and line.count("(") == line.count(")")
+    )
+
+
+def percent_repeats(music_str):
+    """
+    The music of a part, as written by Instrument, with each run of identical measures, or of identical groups of
+    two measures, written once inside \\repeat percent. Measures that are not self-contained (see is_repeatable) are
+    left as they are, and so are the "% Measure" comments, except those inside a run.
+    """
+    lines = music_str.split("\n")
+    # index in lines of each line but the comments, and the line if it is a measure that can be repeated, or None
+    measures = [
+        (line_idx, line if is_repeatable(line) else None)
+        for line_idx, line in enumerate(lines)
+        if not line.startswith("%")
+    ]
+    keys = [key for _, key in measures]
+    out = []
+    line_idx = 0
+    measure_idx = 0
+    while measure_idx < len(measures):
+        n_repeats, group = repeat_at(keys, measure_idx)
+        if n_repeats < 2:
+            measure_idx += 1
+            continue
+        first_line_idx = measures[measure_idx][0]
+        last_line_idx = measures[measure_idx + n_repeats * group - 1][0]
+        out.extend(lines[line_idx:first_line_idx])
+        out.append(f" \\repeat percent {n_repeats} {{")
+        out.extend(keys[measure_idx : measure_idx + group])
+        out.append(" }")
+        line_idx = last_line_idx + 1
+        measure_idx += n_repeats * group
+    out.extend(lines[line_idx:])
+    return "\n".join(out)
+
+
+def repeat_at(keys, start):
+    """The number of repetitions and the number of measures of the group repeated most from the measure at start"""
+    best = (1, 1)
+    for group in range(1, max_group_measures + 1):
+        pattern = keys[start : start + group]
+        if len(pattern) < group or None in pattern:
+            break
+        n_repeats = 1
+        while (
+            keys[start + n_repeats * group : start + (n_repeats + 1) * group] == pattern
+        ):
+            n_repeats += 1
+        if n_repeats >= 2 and n_repeats * group > best[0] * best[1]:
+            best = (n_repeats, group)
+    return best
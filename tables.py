@@ -0,0 +1,73 @@
+"""
+Read-only lookup tables shared by the converter, built once at import instead of in the loops over notes and measures.
+"""
+
+import sys
+from types import MappingProxyType
+
+# <fifths> of a key signature: LilyPond name of its major key
+key_names = MappingProxyType(
+    {
+        "0": "c",
+        "1": "g",
+        "2": "d",
+        "3": "a",
+        "4": "e",
+        "5": "b",
+        "6": "fs",
+        "7": "cs",
+        "-1": "f",
+        "-2": "bf",
+        "-3": "ef",
+        "-4": "af",
+        "-5": "df",
+        "-6": "gf",
+        "-7": "cf",
+    }
+)
+
+# <wedge type>: LilyPond hairpin
+wedges = MappingProxyType(
+    {
+        "crescendo": "\\<",
+        "diminuendo": "\\>",
+        "stop": "\\!",
+    }
+)
+
+# <bar-style>: LilyPond bar line
+bar_styles = MappingProxyType(
+    {
+        "light-light": '"||"',
+        "light-heavy": '"|."',
+        "heavy-light": '".|"',
+    }
+)
+
+dynamics = frozenset(("pp", "p", "mp", "mf", "f", "ff", "fp", "sf", "sfz"))
+
+# <alter>: LilyPond accidental suffix
+alter_suffixes = MappingProxyType({None: "", "1": "s", "-1": "f"})
+
+
+def octave_suffix(octave):
+    """LilyPond octave marks of a MusicXML <octave> number: none for octave 3, the octave below middle C"""
+    octave -= 3
+    if octave < 0:
+        return "," * -octave
+    return "'" * octave
+
+
+octave_suffixes = MappingProxyType(
+    {str(octave): octave_suffix(octave) for octave in range(10)}
+)
+
+# (<step>, <alter>, <octave>): interned LilyPond pitch, for every pitch that alter_suffixes can spell
+pitch_names = MappingProxyType(
+    {
+        (step, alter, octave): sys.intern(step.lower() + alter_suffix + octave_str)
+        for step in "ABCDEFG"
+        for alter, alter_suffix in alter_suffixes.items()
+        for octave, octave_str in octave_suffixes.items()
+    }
+)
@@ -0,0 +1,18 @@
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+# the modules live at the root of the repository, which is not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def spawn(monkeypatch):
+    """Start worker processes with spawn, as on Windows and macOS, so that each one has its own str hash seed"""
+    monkeypatch.delenv("PYTHONHASHSEED", raising=False)
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    yield
+    multiprocessing.set_start_method(start_method, force=True)
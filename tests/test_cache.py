@@ -0,0 +1,29 @@
+import xmlbackend
+from cache import PartCache
+from instrument import element_fingerprint
+
+part_list = xmlbackend.fromstring(
+    '<part-list><score-part id="P1"><part-name>Flute</part-name></score-part></part-list>'
+)
+
+
+def part(measure_xml):
+    return xmlbackend.fromstring(f'<part id="P1">{measure_xml}</part>')
+
+
+def test_key_depends_on_nesting(tmp_path):
+    cache = PartCache(str(tmp_path), 1 << 20)
+    # the same elements in the same order, with the note inside or after the direction
+    nested = part(
+        '<measure number="1"><direction><direction-type><words>dolce</words></direction-type>'
+        "<note><rest/><duration>4</duration></note></direction></measure>"
+    )
+    flat = part(
+        '<measure number="1"><direction><direction-type><words>dolce</words></direction-type></direction>'
+        "<note><rest/><duration>4</duration></note></measure>"
+    )
+    assert element_fingerprint(nested) != element_fingerprint(flat)
+    assert cache.key(nested, part_list) != cache.key(flat, part_list)
+    assert cache.key(flat, part_list) == cache.key(
+        xmlbackend.fromstring(xmlbackend.tostring(flat)), part_list
+    )
@@ -0,0 +1,109 @@
+import json
+import os
+import warnings
+
+import pytest
+
+import mxml2ly
+import xmlbackend
+from excerpt import MeasureIndex, index_suffix, measure_range
+from test_parallel_measures import score_with_changes
+
+
+@pytest.fixture
+def score_path(tmp_path):
+    """
+    The score of score_with_changes, where the divisions also change on their own at measure 170 (after the time
+    signature, so they only apply to backups and forwards) and measure 180 ends with a direction for the next note
+    """
+    root = score_with_changes()
+    measures = list(root.find("part"))
+    measures[169].insert(
+        0, xmlbackend.fromstring("<attributes><divisions>24</divisions></attributes>")
+    )
+    for measure in measures[169:]:
+        for child in measure:
+            if child.tag in ("backup", "forward"):
+                duration = child.find("duration")
+                duration.text = str(int(duration.text) * 2)
+    measures[179].append(
+        xmlbackend.fromstring(
+            "<direction><direction-type><words>rit.</words></direction-type></direction>"
+        )
+    )
+    path = tmp_path / "score.musicxml"
+    path.write_bytes(xmlbackend.tostring(root))
+    return path
+
+
+def music_lines(ly, first, last):
+    """The lines of the music converted for measures first to last, which must start a line of four measures"""
+    start = ly.index(f"% Measure {first}\n") + len(f"% Measure {first}\n")
+    end = ly.find(f"% Measure {int(last) + 1}\n", start)
+    if end < 0:
+        end = ly.index("\n}", start) + 1
+    return [
+        line for line in ly[start:end].splitlines() if not line.startswith("% Measure")
+    ]
+
+
+def convert(source, measures=None):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return mxml2ly.convert(source, measures=measures)
+
+
+# measures after the clef change, the key change, the divisions and time change, the divisions change alone and the
+# trailing direction
+@pytest.mark.parametrize(
+    "first, last",
+    [("61", "72"), ("101", "112"), ("141", "152"), ("177", "184"), ("181", "192")],
+)
+@pytest.mark.parametrize("by_path", [True, False])
+def test_excerpt_matches_full_conversion(score_path, first, last, by_path):
+    full = music_lines(convert(str(score_path)), first, last)
+    source = str(score_path) if by_path else score_path.read_bytes()
+    excerpt = music_lines(convert(source, (first, last)), first, last)
+    assert excerpt[1:] == full[1:]
+    # the first measure also sets the attributes in effect before it
+    assert excerpt[0].endswith(full[0].lstrip())
+    replayed = excerpt[0][: -len(full[0].lstrip())]
+    assert "\\clef bass" in replayed or "\\clef F" in replayed
+    assert "\\key" in replayed and "\\time" in replayed
+
+
+def test_index_is_rebuilt_when_the_file_changes(score_path):
+    index_path = str(score_path) + index_suffix
+    parts = MeasureIndex.load(str(score_path)).parts
+    assert os.path.exists(index_path)
+
+    # an index whose stamp matches is used as it is
+    with open(index_path) as index_file:
+        saved = json.load(index_file)
+    saved["parts"] = []
+    with open(index_path, "w") as index_file:
+        json.dump(saved, index_file)
+    assert MeasureIndex.load(str(score_path)).parts == []
+
+    stat = os.stat(score_path)
+    os.utime(score_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert MeasureIndex.load(str(score_path)).parts == parts
+
+    # a larger file, whose parts start further on
+    score_path.write_bytes(b"\n" + score_path.read_bytes())
+    index = MeasureIndex.load(str(score_path))
+    assert index.stamp[0] == stat.st_size + 1
+    assert index.parts[0][1][0][1] == parts[0][1][0][1] + 1
+    with open(index_path) as index_file:
+        assert json.load(index_file)["stamp"] == index.stamp
+
+
+def test_measure_range():
+    numbers = ["1", "2", "3", "3", "4"]
+    assert measure_range(numbers, "2", "3", "P1") == (1, 4)
+    with pytest.raises(ImportError):
+        measure_range(numbers, "2", "7", "P1")
+    with pytest.raises(ImportError):
+        measure_range(numbers, "0", "3", "P1")
+    with pytest.raises(ImportError):
+        measure_range(numbers, "4", "2", "P1")
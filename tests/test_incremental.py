@@ -0,0 +1,59 @@
+import copy
+import random
+import warnings
+
+import pytest
+
+import xmlbackend
+from benchmarks import synthetic
+from benchmarks.incremental import edit_measures
+from instrument import Instrument
+
+
+@pytest.fixture
+def score():
+    return xmlbackend.fromstring(synthetic.generate(parts=3, measures=120, seed=2))
+
+
+def convert(part, part_list, checkpoints=None):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return Instrument(part, part_list, False, checkpoints=checkpoints)
+
+
+@pytest.mark.parametrize("measure_idx", [0, 1, 57, 119])
+def test_one_edited_measure(score, measure_idx):
+    part_list = score.find("part-list")
+    for part in score.findall("part"):
+        previous = convert(part, part_list, checkpoints={})
+        edited = copy.deepcopy(part)
+        measure = list(edited)[measure_idx]
+        steps = list(measure.iter("step"))
+        if steps:
+            steps[0].text = "A" if steps[0].text != "A" else "B"
+        else:
+            measure.insert(
+                0,
+                xmlbackend.fromstring(
+                    "<direction><direction-type><dynamics><ff/></dynamics></direction-type></direction>"
+                ),
+            )
+
+        incremental = convert(edited, part_list, checkpoints=previous.checkpoints)
+        full = convert(edited, part_list)
+        assert incremental.instrument_str == full.instrument_str
+        assert incremental.n_measures_reused > 0
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_random_edits(score, seed):
+    rng = random.Random(seed)
+    part_list = score.find("part-list")
+    for part in score.findall("part"):
+        previous = convert(part, part_list, checkpoints={})
+        edited = copy.deepcopy(part)
+        edit_measures(edited, rng, 5)
+
+        incremental = convert(edited, part_list, checkpoints=previous.checkpoints)
+        full = convert(edited, part_list)
+        assert incremental.instrument_str == full.instrument_str
@@ -0,0 +1,15 @@
+from fractions import Fraction
+
+import xmlbackend
+from note import Note
+
+
+def test_breve_measure_rest():
+    # a full-measure rest in 4/2, whose type is longer than any duration LilyPond writes as a single number
+    element = xmlbackend.fromstring(
+        '<note><rest measure="yes"/><duration>8</duration><voice>1</voice><type>breve</type></note>'
+    )
+    rest = Note(element, (4, Fraction(2)))
+    assert rest.pitch == ["R"]
+    assert rest.duration == "1*2"
+    assert rest.duration_num == 2
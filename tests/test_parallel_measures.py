@@ -0,0 +1,68 @@
+import warnings
+
+import pytest
+
+import xmlbackend
+from benchmarks import synthetic
+from instrument import Instrument
+from test_parallel_parts import stack_marks
+
+
+def score_with_changes(seed=0):
+    """
+    A one-part synthetic score of 200 measures, with a clef change at measure 60, a key change at measure 100 and the
+    divisions doubled from measure 140 on (along with the time signature, which is when the divisions take effect),
+    and several marks on the first note of every third measure
+    """
+    root = xmlbackend.fromstring(synthetic.generate(parts=1, measures=200, seed=seed))
+    stack_marks(root.find("part"))
+    measures = list(root.find("part"))
+    clef = xmlbackend.fromstring(
+        "<attributes><clef><sign>F</sign><line>4</line></clef></attributes>"
+    )
+    measures[59].insert(0, clef)
+    key = xmlbackend.fromstring(
+        "<attributes><key><fifths>-3</fifths></key></attributes>"
+    )
+    measures[99].insert(0, key)
+    divisions = xmlbackend.fromstring(
+        "<attributes><divisions>12</divisions>"
+        "<time><beats>4</beats><beat-type>4</beat-type></time></attributes>"
+    )
+    measures[139].insert(0, divisions)
+    for measure in measures[139:]:
+        for duration in measure.iter("duration"):
+            duration.text = str(int(duration.text) * 2)
+    return root
+
+
+def convert(root, jobs):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return Instrument(root.find("part"), root.find("part-list"), False, jobs=jobs)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_chunks_match_serial(seed):
+    root = score_with_changes(seed)
+    serial = convert(root, 1)
+    chunked = convert(root, 4)
+    assert chunked.instrument_str == serial.instrument_str
+    assert chunked.n_measures == serial.n_measures == 200
+
+
+def test_chunks_match_serial_in_spawned_workers(spawn):
+    root = score_with_changes()
+    assert convert(root, 4).instrument_str == convert(root, 1).instrument_str
+
+
+def test_percussion_clef_in_a_chunk():
+    root = score_with_changes()
+    clef = xmlbackend.fromstring(
+        "<attributes><clef><sign>percussion</sign></clef></attributes>"
+    )
+    list(root.find("part"))[149].insert(0, clef)
+    serial = convert(root, 1)
+    chunked = convert(root, 4)
+    assert serial.percussion
+    assert chunked.percussion
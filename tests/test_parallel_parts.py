@@ -0,0 +1,33 @@
+import warnings
+
+import mxml2ly
+import xmlbackend
+from benchmarks import synthetic
+
+# words, a dynamic and a hairpin on the same note, written in the order they come whatever the hash seed
+stacked_marks = (
+    "<direction><direction-type><words>espr.</words></direction-type>"
+    "<direction-type><dynamics><mf/></dynamics></direction-type>"
+    '<direction-type><wedge type="crescendo"/></direction-type></direction>'
+)
+
+
+def stack_marks(part, every=3):
+    """Put stacked_marks before the first note of every few measures of part"""
+    for measure in list(part)[::every]:
+        for idx, child in enumerate(measure):
+            if child.tag == "note":
+                measure.insert(idx, xmlbackend.fromstring(stacked_marks))
+                break
+
+
+def test_jobs_match_serial(spawn):
+    root = xmlbackend.fromstring(synthetic.generate(parts=8, measures=60, seed=3))
+    for part in root.findall("part"):
+        stack_marks(part)
+    source = xmlbackend.tostring(root)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        serial = mxml2ly.convert(source)
+        parallel = mxml2ly.convert(source, jobs=4)
+    assert parallel == serial
@@ -0,0 +1,119 @@
+import copy
+import re
+import warnings
+
+import pytest
+
+import mxml2ly
+import xmlbackend
+from benchmarks import synthetic
+from repeats import is_repeatable, percent_repeats
+
+repeat_pattern = re.compile(r" \\repeat percent (\d+) \{\n(.*?)\n \}", re.S)
+
+
+def expand(music):
+    """The lines of music with each percent repeat written out in full, without the "% Measure" comments"""
+    expanded = repeat_pattern.sub(
+        lambda match: "\n".join([match[2]] * int(match[1])), music
+    )
+    return [line for line in expanded.split("\n") if not line.startswith("%")]
+
+
+def convert(root, **options):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return mxml2ly.convert(xmlbackend.tostring(root), **options)
+
+
+def score_with_runs(seed=0):
+    """A synthetic score in which every part repeats some of its measures, alone or in pairs"""
+    root = xmlbackend.fromstring(synthetic.generate(parts=3, measures=80, seed=seed))
+    for part in root.findall("part"):
+        measures = list(part)
+        for start, group, n_repeats in ((4, 1, 4), (20, 2, 3), (41, 1, 2), (60, 2, 2)):
+            for repeat_idx in range(1, n_repeats):
+                for idx in range(group):
+                    measure = measures[start + idx]
+                    target = measures[start + repeat_idx * group + idx]
+                    target[:] = [
+                        copy.deepcopy(child)
+                        for child in measure
+                        if child.tag != "attributes"
+                    ]
+    return root
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_folded_measures_expand_to_the_unfolded_ones(seed):
+    root = score_with_runs(seed)
+    unfolded = convert(root)
+    folded = convert(root, repeats=True)
+    assert "\\repeat percent" in folded
+    assert expand(folded) == expand(unfolded)
+    for match in repeat_pattern.finditer(folded):
+        assert all(is_repeatable(line) for line in match[2].split("\n"))
+
+
+@pytest.mark.parametrize(
+    "measure",
+    [
+        " c'4~ c'4 d'2|",
+        " c'4( d'4 e'2|",
+        " c'4 d'4 e'2)|",
+        " c'1\\<|",
+        " c'1\\!|",
+        " c'1\\cresc|",
+        " c'1\\startTrillSpan|",
+        " c'1\\glissando|",
+        " \\ottava #1 c'1|",
+        " \\clef bass c1|",
+        " \\key d \\major d'1|",
+        " \\time 4/4 c'1|",
+        " \\tempo 4 = 120 c'1|",
+        ' c\'1 \\bar "||"|',
+        " R1|",
+        " <c' e'>4 q4 q2|",
+        " << {c'2 d'2 } \\\\ { e'1|",
+        " \\new CueVoice { c'1|",
+    ],
+)
+def test_unsafe_measures_are_not_folded(measure):
+    assert not is_repeatable(measure)
+    music = "\n".join([measure] * 4)
+    assert percent_repeats(music) == music
+    # nor in a group of two with a measure that could be repeated
+    music = "\n".join([measure, " c'1|"] * 3)
+    assert percent_repeats(music) == music
+
+
+def test_run_is_folded():
+    music = "% Measure 1\n c'1|\n c'1|\n c'1|\n% Measure 5\n c'1|\n d'1|"
+    assert (
+        percent_repeats(music) == "% Measure 1\n \\repeat percent 4 {\n c'1|\n }\n d'1|"
+    )
+
+
+def score_with_doubled_part():
+    """A score whose parts Violin 1 and Violin 2 have the same music"""
+    root = xmlbackend.fromstring(synthetic.generate(parts=3, measures=40, seed=4))
+    for score_part, name in zip(
+        root.find("part-list"), ("Violin 1", "Violin 2", "Viola")
+    ):
+        score_part.find("part-name").text = name
+    first, second, _ = root.findall("part")
+    second[:] = [copy.deepcopy(measure) for measure in first]
+    return root
+
+
+def test_identical_parts_share_their_music():
+    root = score_with_doubled_part()
+    shared = convert(root)
+    assert "Violin_II = \\Violin_I\n" in shared
+    assert "Viola = \\Violin" not in shared
+
+    unshared = convert(root, share_parts=False)
+    assert "Violin_II = \\Violin_I" not in unshared
+    assert unshared.count("= \\compressMMRests {") == 3
+    music = re.search(r"Violin_I = (\\compressMMRests \{.*?\n\})", unshared, re.S)[1]
+    assert f"Violin_II = {music}" in unshared
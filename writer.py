@@ -0,0 +1,91 @@
+class LilyPondWriter:
+    """
+    Writes a LilyPond file to a text stream as the score is converted: the header first, then each part's music
+    variable as soon as its Instrument is done, and the name variables and book blocks once all parts are written.
+    Only the short per-part strings are kept until the end.
+    """
+
+    def __init__(self, out, parts):
+        self.out = out
+        self.parts = parts
+        self.n_instruments = 0
+        self.name_strs = []
+        self.book_strs = []
+        self.book_part_strs = []
+        self.staff_strs = []
+
+    def write_header(self, title, subtitle, composer, arranger, version):
+        self.out.write(
+            f'\\version "{version}"\n\\language "english"\n#(set-default-paper-size "letter")\n%\\pointAndClickOff\n\n'
+        )
+        self.out.write(f"""\\header {{
+      title = "{title}"
+      subtitle = {subtitle}
+      composer = "{composer}"
+      arranger = "arr. {arranger}"
+      tagline = #f
+    }}
+    ub = \\upbow
+    db = \\downbow
+    """)
+
+    def write_instrument(self, instrument):
+        if instrument.percussion:
+            return
+        if self.n_instruments > 0:
+            self.out.write("\n\n\n")
+        self.out.write(instrument.instrument_str)
+        self.n_instruments += 1
+        self.name_strs.append(instrument.name_str)
+        self.book_strs.append(instrument.book_str)
+        self.book_part_strs.append(instrument.book_part_str)
+        self.staff_strs.append(
+            f"      \\new Staff \\with {{ instrumentName = \\{instrument.full_name_var} "
+            f"shortInstrumentName = \\{instrument.short_name_var} }} \\{instrument.var_name}"
+        )
+
+    def write_footer(self):
+        self.out.write("\n\n")
+        self.out.write("".join(self.name_strs))
+        if self.parts == "together":
+            self.out.write("\n% Separate Files for Each Instrument\n%{\n")
+        else:
+            self.out.write("\n% Separate Files for Each Instrument\n%%{\n")
+        self.out.write("".join(self.book_strs))
+
+        if self.parts == "together":
+            self.out.write("%}\n\n% One File for All Instruments\n%%{")
+        else:
+            self.out.write("%}\n\n% One File for All Instruments\n%{")
+        self.out.write("""
+\\book {
+  \\bookOutputSuffix "Parts"
+  \\paper {
+    print-page-number = ##f
+  }
+  """)
+        self.out.write("".join(self.book_part_strs))
+        self.out.write("}\n%}\n")
+        self.out.write("""
+% Full Score
+%%{
+\\book {
+  \\paper {
+    #(layout-set-staff-size 17)
+    left-margin = 0.5\\cm
+    indent = 1.5\\cm
+    short-indent = 1.0\\cm  
+  }
+
+  \\bookOutputSuffix "Full Score"
+  \\header { instrument = "Full Score" }
+  \\score {
+    <<
+""")
+        self.out.write("\n".join(self.staff_strs))
+        self.out.write("""
+    >>
+  }
+}
+%}
+""")
@@ -0,0 +1,66 @@
+"""
+The ElementTree implementation that scores are read with. By default it is the standard library's
+xml.etree.ElementTree; setting the MXML2LY_XML_BACKEND environment variable to "lxml" selects lxml instead, falling
+back to the standard library if lxml is not installed. lxml is not the default because the converter makes many small
+calls on elements, which cost more with lxml: benchmarks/xml_backend.py compares the two.
+
+Only the functions here depend on the backend. The converter otherwise uses the methods that both kinds of elements
+share (find, iter, get, makeelement...), and creates elements with makeelement so that they match the tree they are
+added to. Comments and processing instructions are left out of the tree by both backends.
+"""
+
+import os
+import xml.etree.ElementTree
+
+name = "etree"
+if os.environ.get("MXML2LY_XML_BACKEND", "etree").lower() == "lxml":
+    try:
+        from lxml import etree as lxml_etree
+
+        name = "lxml"
+    except ImportError:
+        pass
+
+if name == "lxml":
+    parser = lxml_etree.XMLParser(
+        remove_comments=True, remove_pis=True, resolve_entities=False, huge_tree=True
+    )
+
+    def fromstring(text):
+        if isinstance(text, str):
+            text = text.encode()  # lxml rejects strings with an encoding declaration
+        return lxml_etree.fromstring(text, parser)
+
+    def parse(source):
+        return lxml_etree.parse(source, parser)
+
+    def iterparse(source, events):
+        return lxml_etree.iterparse(
+            source,
+            events=events,
+            remove_comments=True,
+            remove_pis=True,
+            resolve_entities=False,
+            huge_tree=True,
+        )
+
+    def tostring(element):
+        return lxml_etree.tostring(element)
+
+else:
+    fromstring = xml.etree.ElementTree.fromstring
+    parse = xml.etree.ElementTree.parse
+    tostring = xml.etree.ElementTree.tostring
+
+    def iterparse(source, events):
+        return xml.etree.ElementTree.iterparse(source, events=events)
+
+
+def is_element(value):
+    """Whether value is an element, of either backend"""
+    return hasattr(value, "tag") and hasattr(value, "iterfind")
+
+
+def is_tree(value):
+    """Whether value is an element tree, of either backend"""
+    return hasattr(value, "getroot")